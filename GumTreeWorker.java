@@ -0,0 +1,144 @@
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Paths;
+import java.util.ArrayList;
+import java.util.List;
+
+import com.github.gumtreediff.actions.Diff;
+import com.github.gumtreediff.actions.EditScript;
+import com.github.gumtreediff.actions.SimplifiedChawatheScriptGenerator;
+import com.github.gumtreediff.actions.model.Action;
+import com.github.gumtreediff.actions.model.TreeAddition;
+import com.github.gumtreediff.actions.model.Update;
+import com.github.gumtreediff.client.Run;
+import com.github.gumtreediff.client.diff.web.VanillaDiffView;
+import com.github.gumtreediff.gen.TreeGenerators;
+import com.github.gumtreediff.matchers.Mapping;
+import com.github.gumtreediff.matchers.MappingStore;
+import com.github.gumtreediff.matchers.Matcher;
+import com.github.gumtreediff.matchers.Matchers;
+import com.github.gumtreediff.tree.Tree;
+import com.github.gumtreediff.tree.TreeContext;
+import com.google.gson.Gson;
+import com.google.gson.JsonArray;
+import com.google.gson.JsonObject;
+import org.rendersnake.HtmlCanvas;
+
+/**
+ * Long-lived GumTree process rendering the html diffs of extract_cases.py, run as a single file
+ * program with the jars of a GumTree distribution: java -cp "$GUMTREE_HOME/lib/*" GumTreeWorker.java
+ *
+ * Each line of the standard input is a job: the before file, the after file, the tree generator,
+ * then a matcher and its output file for each rendering, separated by tabs. An empty generator
+ * or matcher selects the default one. Both files are parsed once for all the matchers. Each job
+ * is answered by a line of the standard output with one tab separated status per rendering:
+ * ok, or error followed by a space and the message.
+ *
+ * A rendering whose output file is - is not rendered in html, its status is ok followed by a space
+ * and a single line JSON object with the mappings and the edit script. Nodes are written as
+ * [type, label, start position, end position].
+ *
+ * The worker is written against the API of GumTree 3.0.0, GUMTREE_RELEASE in gumtree_worker.py:
+ * Run.initGenerators, TreeGenerators.getTree, Matchers.getMatcher, the VanillaDiffView constructor
+ * and the Gson bundled with the distribution. Its html must be the one of gumtree htmldiff, which
+ * extract_cases.py --check-worker --gumtree-home checks on a CSV of cases, as does
+ * tests/test_gumtree_worker_java.py with GUMTREE_HOME set. It has not been run on a distribution
+ * yet, run that check before relying on it.
+ */
+public class GumTreeWorker {
+    public static void main(String[] args) throws Exception {
+        Run.initGenerators();
+        PrintStream replies = new PrintStream(new FileOutputStream(FileDescriptor.out), true, StandardCharsets.UTF_8);
+        // Anything GumTree prints goes to the standard error, the standard output is the protocol
+        System.setOut(System.err);
+        BufferedReader jobs = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        String line;
+        while ((line = jobs.readLine()) != null) {
+            String[] job = line.split("\t", -1);
+            List<String> statuses = new ArrayList<>();
+            try {
+                TreeContext src = parse(job[0], emptyToNull(job[2]));
+                TreeContext dst = parse(job[1], emptyToNull(job[2]));
+                for (int rendering = 3; rendering + 1 < job.length; rendering += 2)
+                    statuses.add(render(job[0], job[1], src, dst, emptyToNull(job[rendering]), job[rendering + 1]));
+            } catch (Throwable error) {
+                // Errors are per job, even an OutOfMemoryError leaves the worker usable
+                while (statuses.size() < (job.length - 3) / 2)
+                    statuses.add(error(error));
+            }
+            replies.println(String.join("\t", statuses));
+        }
+    }
+
+    private static TreeContext parse(String file, String generator) throws Exception {
+        return generator == null ? TreeGenerators.getInstance().getTree(file) : TreeGenerators.getInstance().getTree(file, generator);
+    }
+
+    private static String render(String before, String after, TreeContext src, TreeContext dst, String matcherName, String outputFile) {
+        try {
+            Matcher matcher = matcherName == null ? Matchers.getInstance().getMatcher() : Matchers.getInstance().getMatcher(matcherName);
+            MappingStore mappings = matcher.match(src.getRoot(), dst.getRoot());
+            EditScript editScript = new SimplifiedChawatheScriptGenerator().computeActions(mappings);
+            if (outputFile.equals("-"))
+                return "ok " + edits(mappings, editScript);
+            VanillaDiffView view = new VanillaDiffView(new File(before), new File(after), new Diff(src, dst, mappings, editScript), true);
+            HtmlCanvas canvas = new HtmlCanvas();
+            view.renderOn(canvas);
+            Files.writeString(Paths.get(outputFile), canvas.toHtml());
+            return "ok";
+        } catch (Throwable error) {
+            return error(error);
+        }
+    }
+
+    private static String edits(MappingStore mappings, EditScript editScript) {
+        JsonArray mappingsJson = new JsonArray();
+        for (Mapping mapping : mappings) {
+            JsonArray pair = new JsonArray();
+            pair.add(node(mapping.first));
+            pair.add(node(mapping.second));
+            mappingsJson.add(pair);
+        }
+        JsonArray actionsJson = new JsonArray();
+        for (Action action : editScript) {
+            JsonObject actionJson = new JsonObject();
+            actionJson.addProperty("action", action.getName());
+            actionJson.add("tree", node(action.getNode()));
+            if (action instanceof TreeAddition) {
+                actionJson.add("parent", node(((TreeAddition) action).getParent()));
+                actionJson.addProperty("at", ((TreeAddition) action).getPosition());
+            }
+            if (action instanceof Update)
+                actionJson.addProperty("label", ((Update) action).getValue());
+            actionsJson.add(actionJson);
+        }
+        JsonObject edits = new JsonObject();
+        edits.add("mappings", mappingsJson);
+        edits.add("actions", actionsJson);
+        // Compact Gson output escapes tabs and newlines, the edits stay on the status line
+        return new Gson().toJson(edits);
+    }
+
+    private static JsonArray node(Tree tree) {
+        JsonArray node = new JsonArray();
+        node.add(tree.getType().name);
+        node.add(tree.getLabel());
+        node.add(tree.getPos());
+        node.add(tree.getEndPos());
+        return node;
+    }
+
+    private static String error(Throwable error) {
+        return "error " + String.valueOf(error).replace('\t', ' ').replace('\n', ' ');
+    }
+
+    private static String emptyToNull(String value) {
+        return value.isEmpty() ? null : value;
+    }
+}
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import glob
+import hashlib
+import shutil
+import tempfile
+
+def digest(content):
+    return hashlib.sha256(content).hexdigest()
+
+def blob_path(store, blob_digest):
+    return f"{store}/{blob_digest[:2]}/{blob_digest[2:]}"
+
+def put(store, content):
+    """
+    Add content to the store and return its digest. Blobs are written once, through a
+    temporary file renamed in place, and made read-only since they are shared by hardlinks.
+    """
+    blob_digest = digest(content)
+    path = blob_path(store, blob_digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, partial = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.chmod(partial, 0o444)
+        os.replace(partial, path)
+    return blob_digest
+
+def materialize(store, blob_digest, dest):
+    """
+    Make dest a hardlink to a blob of the store, or a copy when the store is on another file system.
+    """
+    if os.path.lexists(dest):
+        os.remove(dest)
+    try:
+        os.link(blob_path(store, blob_digest), dest)
+    except OSError:
+        shutil.copyfile(blob_path(store, blob_digest), dest)
+
+def write(store, content, dest):
+    blob_digest = put(store, content)
+    materialize(store, blob_digest, dest)
+    return blob_digest
+
+def copy(store, source, dest):
+    with open(source, 'rb') as f:
+        return write(store, f.read(), dest)
+
+def deduplicate(store, tree):
+    """
+    Replace every file of an existing dataset tree by a hardlink to the store.
+    Returns the number of files and of distinct blobs.
+    """
+    files = 0
+    blobs = set()
+    for file in glob.glob(f"{tree}/**/*", recursive = True):
+        if os.path.isfile(file) and not os.path.islink(file):
+            blobs.add(copy(store, file, file))
+            files += 1
+    return files, len(blobs)
+
+if __name__ == '__main__':
+    store = sys.argv[1]
+    for tree in sys.argv[2:]:
+        files, blobs = deduplicate(store, tree)
+        print(f"{tree}: {str(files)} files, {str(blobs)} distinct blobs")
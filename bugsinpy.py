@@ -2,69 +2,126 @@
 
 import sys
 import os
-import glob
-import filecmp
-import shutil
 import re
+import glob
+import threading
+import argparse
+import vcs
+import metadata
+import extraction
+from extraction import AFTER_FOLDER_NAME, BEFORE_FOLDER_NAME
+
+class BugsInPy(extraction.Backend):
+    name = "bugsinpy"
+    extension = ".py"
+
+    def __init__(self, b4p_bin, concurrency=1, metadata_cache=None, mirror_path=None, bugsinpy_home=None):
+        super().__init__(concurrency, metadata_cache)
+        self.b4p_bin = b4p_bin
+        self.mirror_path = mirror_path
+        self.bugsinpy_home = bugsinpy_home
+        if self.bugsinpy_home == None:
+            self.bugsinpy_home = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(b4p_bin))))
+        self.mirror_locks = {}
+        self.mirror_locks_guard = threading.Lock()
+
+    def projects(self):
+        return projects()
+
+    def active_bugs(self, project):
+        return sorted((int(bug) for bug in self.bug_catalogue(project)))
+
+    def bug_catalogue(self, project):
+        """
+        Return the bug.info of every bug of a project, read from the BugsInPy framework
+        folder instead of one bugsinpy-info call per bug.
+        """
+        bugs_path = f"{self.bugsinpy_home}/projects/{project}/bugs"
+        # Editing a bug.info leaves the mtime of the bugs folder unchanged, only adding or removing a bug changes it
+        sources = lambda: [bugs_path] + sorted(glob.glob(f"{bugs_path}/*/bug.info"))
+        return metadata.catalogue(self.metadata_cache, project, sources, lambda _: read_bug_infos(bugs_path))
+
+    async def checkout(self, project, bug, version, work_path):
+        """
+        Check out the buggy or fixed version of a bug in work_path/project, either with
+        bugsinpy-checkout or as a worktree of the local mirror of the project.
+        """
+        if self.mirror_path == None:
+            version_id = "0" if version == BEFORE_FOLDER_NAME else "1"
+            await extraction.run_command("checkout", [f"{self.b4p_bin}-checkout", "-p", project, "-v", version_id, "-i", str(bug), "-w", work_path])
+        else:
+            info = self.bug_catalogue(project)[str(bug)]
+            revision = info["buggy_commit_id"] if version == BEFORE_FOLDER_NAME else info["fixed_commit_id"]
+            # bugsinpy-checkout gives the buggy version the test files of the fixed one
+            test_files = test_paths(info) if version == BEFORE_FOLDER_NAME else []
+            await extraction.run_git("checkout", self.add_worktree, project, revision, f"{work_path}/{project}", info["fixed_commit_id"], test_files)
+        return f"{work_path}/{project}"
+
+    async def release(self, project, work_path):
+        if self.mirror_path != None and os.path.exists(f"{work_path}/{project}"):
+            await extraction.run_git("release", self.remove_worktree, project, f"{work_path}/{project}")
+
+    def add_worktree(self, project, revision, worktree, overlay_revision=None, overlay_paths=()):
+        mirror = self.project_mirror(project)
+        with self.mirror_lock(project):
+            vcs.add_worktree(mirror, revision, worktree)
+        if len(overlay_paths) > 0:
+            vcs.git(worktree, "checkout", overlay_revision, "--", *overlay_paths)
+
+    def remove_worktree(self, project, worktree):
+        mirror = self.project_mirror(project)
+        with self.mirror_lock(project):
+            vcs.remove_worktree(mirror, worktree)
+
+    def mirror_lock(self, project):
+        with self.mirror_locks_guard:
+            return self.mirror_locks.setdefault(project, threading.Lock())
+
+    def project_mirror(self, project):
+        """
+        Return the local mirror of a project, cloning it on first use.
+        """
+        mirror = f"{self.mirror_path}/{project}.git"
+        with self.mirror_lock(project):
+            if not os.path.exists(mirror):
+                print(f"Mirroring {project}")
+                os.makedirs(self.mirror_path, exist_ok=True)
+                vcs.clone_mirror(read_info(f"{self.bugsinpy_home}/projects/{project}/project.info")["github_url"], mirror)
+        return mirror
+
+def read_info(info_file):
+    """
+    Read the key="value" lines of a BugsInPy project.info or bug.info file.
+    """
+    info = {}
+    with open(info_file) as f:
+        for line in f:
+            match = re.match(r'\s*(\w+)\s*=\s*"?([^"]*)"?\s*$', line)
+            if match:
+                info[match.group(1)] = match.group(2)
+    return info
+
+def test_paths(info):
+    """
+    Return the paths of the test_file entry of a bug.info, separated by semicolons.
+    """
+    return [path.strip() for path in info.get("test_file", "").split(";") if path.strip() != ""]
+
+def read_bug_infos(bugs_path):
+    bugs = {}
+    for bug in os.listdir(bugs_path):
+        # Bugs without a bug.info are deprecated
+        if os.path.exists(f"{bugs_path}/{bug}/bug.info"):
+            bugs[bug] = read_info(f"{bugs_path}/{bug}/bug.info")
+    return bugs
 
-BEFORE_FOLDER_NAME = "before"
-AFTER_FOLDER_NAME = "after"
-
-def main():
-    print("Starting checkout")
-    print("Projects : ")
-    print(projects())
-    for project in projects():
-        process(project)
-
-def process(project):
-    print("Processing " + project)
-    bugs = active_bugs(project)
-    print(f"Found {str(bugs)} active bugs")
-    for bug in range(1, bugs + 1):
-        print(f"Checking bug {str(bug)}")
-
-        bug_before_path = f"{out_path}/{BEFORE_FOLDER_NAME}/{project}"/"{str(bug)}"
-        bug_after_path = f"{out_path}/{AFTER_FOLDER_NAME}/{project}"/"{str(bug)}"
-
-        if os.path.exists(bug_before_path) or os.path.exists(bug_after_path):
-            print(f"Bug {str(bug)} already processed, skipping")
-            continue
-
-        code = os.system(f"{b4p_bin}-info -p {project} -i {str(bug)}")
-        if code != 0:
-            print(f"Bug {str(bug)} is deprecated, skipping")
-            continue
-
-        os.system(f"mkdir -p {bug_before_path}")
-        os.system(f"mkdir -p {bug_after_path}")
-        os.system(f"{b4p_bin}-checkout -p {project} -v 0 -i {str(bug)} -w {tmp_path} /{BEFORE_FOLDER_NAME}")
-        os.system(f"{b4p_bin}-checkout -p {project} -v 1 -i {str(bug)} -w {tmp_path} /{AFTER_FOLDER_NAME}")
-        changed_files = compare(f"{tmp_path}/{BEFORE_FOLDER_NAME}/{project}", f"{tmp_path}/{AFTER_FOLDER_NAME}/{project}")
-        for changed_file in changed_files:
-            print(f"Copying {str(changed_file)}")
-            before_source = changed_file[1]
-            before_dest = f"{bug_before_path}/{changed_file[0].replace('/','_')}"
-            shutil.copyfile(before_source, before_dest)
-            after_source = changed_file[2]
-            after_dest = f"{bug_after_path}/{changed_file[0].replace('/','_')}"
-            shutil.copyfile(after_source, after_dest)
-
-def active_bugs(project):
-    stream = os.popen(f"{b4p_bin}-info -p {project} | grep 'Number of bugs'")
-    output = stream.read()
-    match = re.search(r'Number of bugs\s+:\s+(\d+)', output.splitlines()[0])
-    return int(match.group(1))
-
-def compare(before, after):
-    comparison = []
-    for file in glob.glob(f"{BEFORE_FOLDER_NAME}/**/*.py", recursive = True):
-        base = file[len(before) + 1:]
-        other = f"{after}/{base}"
-        if os.path.exists(other):
-            if filecmp.cmp(file, other) == False:
-                comparison.append((base, file, other))
-    return comparison
+def main(args):
+    metadata_cache = args.metadata_cache
+    if metadata_cache == None:
+        metadata_cache = f"{args.tmp_path}/bugsinpy-metadata.json"
+    backend = BugsInPy(args.b4p_bin, args.jobs, metadata_cache, args.mirror_cache, args.bugsinpy_home)
+    failures = extraction.from_arguments(args).run(backend)
+    return 1 if len(failures) > 0 else 0
 
 def projects():
     projects = '''sanic
@@ -102,7 +159,9 @@ tqdm'''
     return projects.splitlines()
 
 if __name__ == '__main__':
-    b4p_bin = sys.argv[1]
-    out_path = sys.argv[2]
-    tmp_path = sys.argv[3]
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Extract the changed files of the BugsInPy bugs.")
+    parser.add_argument("b4p_bin", help="path prefix of the bugsinpy executables (without -info/-checkout)")
+    extraction.add_arguments(parser)
+    parser.add_argument("--mirror-cache", help="folder of local project mirrors serving the checkouts instead of bugsinpy-checkout")
+    parser.add_argument("--bugsinpy-home", help="root of the BugsInPy framework, defaults to three levels above b4p_bin")
+    sys.exit(main(parser.parse_args()))
@@ -2,68 +2,115 @@
 
 import sys
 import os
-import glob
-import filecmp
+import re
+import csv
 import shutil
+import argparse
+import vcs
+import metadata
+import extraction
+from extraction import BEFORE_FOLDER_NAME
 
-BEFORE_FOLDER_NAME = "before"
-AFTER_FOLDER_NAME = "after"
-
-def main():
-    print("Starting checkout")
-    print("Projects : ")
-    print(projects())
-    for project in projects():
-        process(project)
-
-def process(project):
-    print(f"Processing {project}")
-    bugs = active_bugs(project)
-    for bug in bugs:
-        print(f"Checking bug {str(bug)}")
-
-        bug_before_path = f"{out_path}/{BEFORE_FOLDER_NAME}/{project}/{str(bug)}"
-        bug_after_path = f"{out_path}/{AFTER_FOLDER_NAME}/{project}/{str(bug)}"
-
-        if os.path.exists(bug_before_path) or os.path.exists(bug_after_path):
-            print(f"Bug {str(bug)} already processed, skipping")
-            continue
-
-        code = os.system(f"{d4j_bin} info -p {project} -b {str(bug)}")
-        if code != 0:
-            print(f"Bug {str(bug)} is deprecated, skipping")
-            continue
-
-        os.system(f"mkdir -p {bug_before_path}")
-        os.system(f"mkdir -p {bug_after_path}")
-        os.system(f"{d4j_bin} checkout -p {project} -v{str(bug)}b -w {tmp_path}/{BEFORE_FOLDER_NAME}")
-        os.system(f"{d4j_bin} checkout -p {project} -v{str(bug)}f -w {tmp_path}/{AFTER_FOLDER_NAME}")
-        changed_files = compare(f"{tmp_path}/{BEFORE_FOLDER_NAME}", f"{tmp_path}/{AFTER_FOLDER_NAME}")
-        for changed_file in changed_files:
-            print(f"Copying {str(changed_file)}")
-            before_source = changed_file[1]
-            before_dest = f"{bug_before_path}/{changed_file[0].replace('/','_')}"
-            shutil.copyfile(before_source, before_dest)
-            after_source = changed_file[2]
-            after_dest = f"{bug_after_path}/{changed_file[0].replace('/','_')}"
-            shutil.copyfile(after_source, after_dest)
-    sys.exit(0)
-
-def active_bugs(project):
-    stream = os.popen(f"{d4j_bin} bids -p {project}")
-    output = stream.read()
-    return output.splitlines()
-
-def compare(before, after):
-    comparison = []
-    for file in glob.glob(f"{before}/**/*.java", recursive = True):
-        base = file[len(before) + 1:]
-        other = f"{after}/{base}"
-
-        if os.path.exists(other):
-            if filecmp.cmp(file, other) == False:
-                comparison.append((base, file, other))
-    return comparison
+class Defects4J(extraction.Backend):
+    name = "defects4j"
+    extension = ".java"
+
+    def __init__(self, d4j_bin, concurrency=1, metadata_cache=None, incremental=False, d4j_home=None):
+        super().__init__(concurrency, metadata_cache)
+        self.d4j_bin = d4j_bin
+        self.d4j_home = d4j_home
+        if self.d4j_home == None:
+            # A bare defects4j is looked up on the PATH, like the checkout command does
+            executable = shutil.which(d4j_bin) or d4j_bin
+            self.d4j_home = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(executable))))
+        self.incremental = incremental
+
+    def projects(self):
+        return projects()
+
+    def bug_catalogue(self, project):
+        """
+        Return the active bugs of a project, read from its active-bugs.csv instead of d4j bids/info.
+        """
+        active_bugs_file = f"{self.d4j_home}/framework/projects/{project}/active-bugs.csv"
+        return metadata.catalogue(self.metadata_cache, project, [active_bugs_file], lambda _: read_active_bugs(active_bugs_file))
+
+    async def checkout(self, project, bug, version, work_path):
+        version_type = "b" if version == BEFORE_FOLDER_NAME else "f"
+        await extraction.run_command("checkout", [self.d4j_bin, "checkout", "-p", project, f"-v{str(bug)}{version_type}", "-w", work_path])
+        return work_path
+
+    def before_revision(self, project, bug):
+        # The fixed checkout also carries the tag of the buggy version
+        return f"D4J_{project}_{str(bug)}_BUGGY_VERSION"
+
+    async def changed_contents(self, project, bug, working_tree):
+        if not self.incremental or self.project_repository(project) == None:
+            return None
+        return await extraction.run_git("switch", self.switch_bug, project, bug, working_tree)
+
+    def switch_bug(self, project, bug, working_tree):
+        """
+        Move the working tree of a project to the fixed revision of a bug and return the
+        (path, before content, after content) of the java files changed by the fix.
+        The Defects4J source patch goes from the fixed to the buggy version, so the buggy
+        content is read after applying it, then the tree is reset for the next bug.
+        Git only rewrites the files that differ between two consecutive revisions.
+        """
+        if not os.path.exists(working_tree):
+            vcs.git(".", "clone", "--quiet", "--shared", "--no-checkout", self.project_repository(project), os.path.abspath(working_tree))
+        patch = f"{self.d4j_home}/framework/projects/{project}/patches/{str(bug)}.src.patch"
+        vcs.git(working_tree, "checkout", "--quiet", "--force", "--detach", self.fixed_revision(project, bug))
+        paths = [path for path in vcs.patch_paths(working_tree, patch) if path.endswith(self.extension)]
+        after_contents = read_files(working_tree, paths)
+        vcs.git(working_tree, "apply", "--whitespace=nowarn", os.path.abspath(patch))
+        before_contents = read_files(working_tree, paths)
+        vcs.git(working_tree, "reset", "--quiet", "--hard")
+        vcs.git(working_tree, "clean", "--quiet", "--force", "-d")
+        return [(path, before_contents[path], after_contents[path]) for path in paths
+                if path in before_contents and path in after_contents and before_contents[path] != after_contents[path]]
+
+    def project_repository(self, project):
+        """
+        Return the git repository of a project inside the Defects4J installation, or None
+        if the project is not versioned with git (Chart is a Subversion repository).
+        """
+        project_module = f"{self.d4j_home}/framework/core/Project/{project}.pm"
+        if not os.path.exists(project_module):
+            return None
+        with open(project_module) as f:
+            source = f.read()
+        match = re.search(r'my \$name\s*=\s*"([^"]+)"', source)
+        if match == None or "Vcs::Git" not in source:
+            return None
+        repository = f"{self.d4j_home}/project_repos/{match.group(1)}.git"
+        return repository if os.path.exists(repository) else None
+
+    def fixed_revision(self, project, bug):
+        return self.bug_catalogue(project)[str(bug)]["revision.id.fixed"]
+
+def read_files(root, paths):
+    contents = {}
+    for path in paths:
+        if os.path.exists(f"{root}/{path}"):
+            with open(f"{root}/{path}", 'rb') as f:
+                contents[path] = f.read()
+    return contents
+
+def read_active_bugs(active_bugs_file):
+    bugs = {}
+    with open(active_bugs_file) as f:
+        for row in csv.DictReader(f):
+            bugs[row["bug.id"]] = row
+    return bugs
+
+def main(args):
+    metadata_cache = args.metadata_cache
+    if metadata_cache == None:
+        metadata_cache = f"{args.tmp_path}/defects4j-metadata.json"
+    backend = Defects4J(args.d4j_bin, args.jobs, metadata_cache, args.incremental, args.defects4j_home)
+    failures = extraction.from_arguments(args).run(backend)
+    return 1 if len(failures) > 0 else 0
 
 def projects():
     projects = '''Chart
@@ -86,7 +133,9 @@ Time'''
     return projects.splitlines()
 
 if __name__ == '__main__':
-    d4j_bin = sys.argv[1]
-    out_path = sys.argv[2]
-    tmp_path = sys.argv[3]
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Extract the changed files of the Defects4J bugs.")
+    parser.add_argument("d4j_bin", help="path to the defects4j executable")
+    extraction.add_arguments(parser)
+    parser.add_argument("--incremental", action="store_true", help="keep one working tree per project and switch it from bug to bug")
+    parser.add_argument("--defects4j-home", help="root of the Defects4J installation, defaults to three levels above the resolved d4j_bin")
+    sys.exit(main(parser.parse_args()))
@@ -1,33 +1,222 @@
 #!/usr/bin/env python3
 
+import os
 import sys
+import gzip
+import json
+import time
+import shlex
+import shutil
+import argparse
+import metadata
+import blobstore
+import gumtree_worker
 import pandas as pd
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
-def extract_cases(cases_file, output_folder):
+# Matchers rendered for each case, None is the default matcher of gumtree
+MATCHERS = [None, "gumtree-simple"]
+# Suffixes of the output files of the matchers, others get their name as suffix
+SUFFIXES = {None: "_opt", "gumtree-simple": "_simple"}
+CACHE_FILE_NAME = ".cache.json"
+
+def extract_cases(cases_file, output_folder, jobs=1, memory=None, worker_command=None, matchers=MATCHERS, version=None, only=None):
+    """
+    Render the html diffs of the cases with up to jobs gumtree processes at a time. memory is
+    the maximum heap of each gumtree JVM, such as 2g, so that jobs * memory fits the machine.
+    With a worker_command, the cases are streamed to jobs long-lived workers instead of
+    starting a gumtree process per diff, and each case is parsed once for all the matchers.
+    Renderings whose inputs, matcher, generator and gumtree version did not change since
+    they were written are skipped, see rendering_key. only restricts the rendering to the cases
+    with these before files, to render the html of a few cases of an edit script store.
+    """
+    cache_file = f"{output_folder}/{CACHE_FILE_NAME}"
+    cache = {}
+    if os.path.exists(cache_file):
+        with open(cache_file) as f:
+            cache = json.load(f)
+    digests = {}
+    keys = {}
+    cases = []
+    for row in read_cases(cases_file, only):
+        case_renderings = []
+        for matcher in matchers:
+            output_file = output_folder + "/" + row["before"].replace("/", "_") + SUFFIXES.get(matcher, f"_{matcher}") + ".html"
+            keys[output_file] = rendering_key(row["before"], row["after"], matcher, generator(row["before"]), version, digests)
+            if keys[output_file] == None or cache.get(os.path.basename(output_file)) != keys[output_file] or not os.path.exists(output_file):
+                case_renderings.append((matcher, output_file))
+        if len(case_renderings) > 0:
+            cases.append((row["before"], row["after"], generator(row["before"]), case_renderings))
+    renderings = [(before, after, matcher, output_file) for before, after, _, case_renderings in cases for matcher, output_file in case_renderings]
+    print(f"{str(len(renderings))} of {str(len(keys))} renderings to update")
+    if worker_command != None:
+        errors = [error for case_results in gumtree_worker.run_jobs(worker_command, cases, jobs) for error, _ in case_results]
+    else:
+        if len(matchers) > 1 and len(renderings) > 0:
+            print(f"gumtree htmldiff parses each case once per matcher, a worker parses it once for the {str(len(matchers))} matchers")
+        environment = dict(os.environ)
+        if memory != None:
+            environment["JAVA_OPTS"] = f"{environment.get('JAVA_OPTS', '')} -Xmx{memory}".strip()
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(render, build_command(before, after, matcher), output_file, environment)
+                       for before, after, matcher, output_file in renderings]
+            errors = [None if future.result() == 0 else "gumtree failed" for future in futures]
+    failures = []
+    for rendering, error in zip(renderings, errors):
+        if error != None:
+            print(f"Failed to render {rendering[3]}: {error}")
+            failures.append(rendering[3])
+            cache.pop(os.path.basename(rendering[3]), None)
+        elif keys[rendering[3]] != None:
+            cache[os.path.basename(rendering[3])] = keys[rendering[3]]
+    metadata.write_json(cache_file, cache)
+    return failures
+
+def extract_edits(cases_file, output_folder, jobs, worker_command, matchers=MATCHERS, only=None):
+    """
+    Write the mappings and edit scripts of the cases for each matcher to a single gzipped JSON
+    Lines store of the run, edits-<date>.jsonl.gz in output_folder, and return its path. Each
+    line holds the before, after, matcher, generator, mappings and actions of a case.
+    """
+    cases = [(row["before"], row["after"], generator(row["before"]), [(matcher, "-") for matcher in matchers])
+             for row in read_cases(cases_file, only)]
+    store = f"{output_folder}/edits-{time.strftime('%Y%m%d-%H%M%S')}.jsonl.gz"
+    os.makedirs(output_folder, exist_ok=True)
+    failures = 0
+    with gzip.open(store, 'wt', encoding="UTF-8") as f:
+        for (before, after, case_generator, _), results in zip(cases, gumtree_worker.run_jobs(worker_command, cases, jobs)):
+            for matcher, (error, edits) in zip(matchers, results):
+                if error != None:
+                    print(f"Failed to diff {before} with {matcher or 'the default matcher'}: {error}")
+                    failures += 1
+                    continue
+                record = {"before": before, "after": after, "matcher": matcher, "generator": case_generator}
+                record.update(json.loads(edits))
+                f.write(json.dumps(record) + "\n")
+    print(f"Wrote {str(len(cases) * len(matchers) - failures)} edit scripts to {store}")
+    return store
+
+def check_worker(cases_file, output_folder, jobs, worker_command, launcher="gumtree", matchers=MATCHERS, only=None):
+    """
+    Render the cases with the worker, each case being one job for all the matchers, and with one
+    htmldiff of the launcher per matcher, into the worker and htmldiff subfolders of output_folder.
+    Return the renderings that failed or whose html differ, to check the worker against the
+    gumtree launcher of the same distribution.
+    """
+    cases = []
+    renderings = []
+    for row in read_cases(cases_file, only):
+        case_renderings = []
+        for matcher in matchers:
+            name = row["before"].replace("/", "_") + SUFFIXES.get(matcher, f"_{matcher}") + ".html"
+            case_renderings.append((matcher, f"{output_folder}/worker/{name}"))
+            renderings.append((row["before"], row["after"], matcher, f"{output_folder}/worker/{name}", f"{output_folder}/htmldiff/{name}"))
+        cases.append((row["before"], row["after"], generator(row["before"]), case_renderings))
+    os.makedirs(f"{output_folder}/worker", exist_ok=True)
+    os.makedirs(f"{output_folder}/htmldiff", exist_ok=True)
+    errors = [error for case_results in gumtree_worker.run_jobs(worker_command, cases, jobs) for error, _ in case_results]
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(render, build_command(before, after, matcher, launcher), reference_file, dict(os.environ))
+                   for before, after, matcher, _, reference_file in renderings]
+        codes = [future.result() for future in futures]
+    differences = []
+    for (_, _, _, output_file, reference_file), error, code in zip(renderings, errors, codes):
+        if error == None and code == 0 and read_file(output_file) == read_file(reference_file):
+            continue
+        reason = error if error != None else "htmldiff failed" if code != 0 else "the html differs"
+        print(f"Worker and htmldiff differ on {output_file}: {reason}")
+        differences.append(output_file)
+    print(f"{str(len(differences))} of {str(len(renderings))} renderings differ")
+    return differences
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def read_edits(store):
+    """
+    Yield the records of an edit script store written by extract_edits.
+    """
+    with gzip.open(store, 'rt', encoding="UTF-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+def read_cases(cases_file, only=None):
     files = pd.read_csv(cases_file)
-    for _, row in files.iterrows():
-        output_file = output_folder + "/" + row["before"].replace("/", "_") + "_opt.html"
-        print(build_command(row["before"], row["after"]))
-        with open(output_file, 'w') as output_file_handle:
-            process = subprocess.Popen(build_command(row["before"], row["after"]), stdout=output_file_handle)
-            process.wait()
-        output_file = output_folder + "/" + row["before"].replace("/", "_") + "_simple.html"
-        with open(output_file, 'w') as output_file_handle:
-            process = subprocess.Popen(build_command(row["before"], row["after"], matcher="gumtree-simple"), stdout=output_file_handle)
-            process.wait()
-
-def build_command(before, after, matcher=None):
-    command = ["gumtree", "htmldiff", before, after]
+    return [row for _, row in files.iterrows() if only == None or row["before"] in only]
+
+def rendering_key(before, after, matcher, generator, version, digests):
+    """
+    Return the key of a rendering in the cache: a hash of the contents of its before and after
+    files, its matcher, its generator and the gumtree version. Without a known gumtree version,
+    or when a file is missing, there is no key and the rendering is always done.
+    """
+    if version == None or not os.path.exists(before) or not os.path.exists(after):
+        return None
+    for path in [before, after]:
+        if path not in digests:
+            with open(path, 'rb') as f:
+                digests[path] = blobstore.digest(f.read())
+    return blobstore.digest("\t".join([digests[before], digests[after], matcher or "", generator or "", version]).encode("UTF-8"))
+
+def render(command, output_file, environment):
+    print(command, flush=True)
+    with open(output_file, 'w') as output_file_handle:
+        process = subprocess.Popen(command, stdout=output_file_handle, env=environment)
+        return process.wait()
+
+def build_command(before, after, matcher=None, launcher="gumtree"):
+    command = [launcher, "htmldiff", before, after]
     if matcher != None:
         command += ["-m", matcher]
-    if before.startswith("bugsinpy") or before.startswith("gh-python"):
-        command += ["-g", "python-treesitter"]
+    if generator(before) != None:
+        command += ["-g", generator(before)]
     return command
 
+def generator(before):
+    if before.startswith("bugsinpy") or before.startswith("gh-python"):
+        return "python-treesitter"
+    return None
+
 if __name__ == '__main__':
-    cases_file = sys.argv[1]
-    output_folder = sys.argv[2]
-    print(cases_file)
-    print(output_folder)
-    extract_cases(cases_file, output_folder)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Render the html diffs of a CSV of cases with gumtree.")
+    parser.add_argument("cases_file", help="CSV file with the before and after paths of the cases")
+    parser.add_argument("output_folder", help="folder of the rendered html files")
+    parser.add_argument("--jobs", type=int, default=1, help="number of gumtree processes running at a time")
+    parser.add_argument("--memory", help="maximum heap of each gumtree process, such as 2g")
+    parser.add_argument("--gumtree-home", help="GumTree distribution running the cases in long-lived GumTreeWorker.java processes")
+    parser.add_argument("--worker-command", help="command of a long-lived worker, such as python3 fake_gumtree_worker.py")
+    parser.add_argument("--matcher", dest="matchers", action="append", help="matcher rendered for each case, default for the default one, can be repeated (default: default and gumtree-simple)")
+    parser.add_argument("--edits", action="store_true", help="write the mappings and edit scripts of all the cases to one edits-<date>.jsonl.gz store instead of html files, needs a worker")
+    parser.add_argument("--open", dest="only", action="append", help="only render the html of the case with this before file, can be repeated")
+    parser.add_argument("--check-worker", action="store_true", help="render the cases with GumTreeWorker.java and with gumtree htmldiff of --gumtree-home, and list the renderings that differ")
+    args = parser.parse_args()
+    if args.edits and args.worker_command == None and args.gumtree_home == None:
+        parser.error("--edits needs --gumtree-home or --worker-command")
+    if args.check_worker and args.gumtree_home == None:
+        parser.error("--check-worker needs --gumtree-home")
+    matchers = MATCHERS
+    if args.matchers != None:
+        matchers = [None if matcher == "default" else matcher for matcher in args.matchers]
+    print(args.cases_file)
+    print(args.output_folder)
+    worker_command = None
+    gumtree_home = args.gumtree_home
+    if gumtree_home == None and shutil.which("gumtree") != None:
+        # The gumtree launcher lives in the bin folder of its distribution
+        gumtree_home = os.path.dirname(os.path.dirname(os.path.realpath(shutil.which("gumtree"))))
+    version = gumtree_worker.gumtree_version(gumtree_home) if gumtree_home != None else None
+    if args.worker_command != None:
+        worker_command = shlex.split(args.worker_command)
+        version = args.worker_command
+    elif args.gumtree_home != None:
+        worker_command = gumtree_worker.worker_command(args.gumtree_home, args.memory)
+        if gumtree_worker.gumtree_release(args.gumtree_home) != gumtree_worker.GUMTREE_RELEASE:
+            print(f"GumTreeWorker.java is written against GumTree {gumtree_worker.GUMTREE_RELEASE}, check it with --check-worker on this distribution")
+    if args.check_worker:
+        sys.exit(1 if len(check_worker(args.cases_file, args.output_folder, args.jobs, worker_command, f"{args.gumtree_home}/bin/gumtree", matchers, args.only)) > 0 else 0)
+    if args.edits:
+        extract_edits(args.cases_file, args.output_folder, args.jobs, worker_command, matchers, args.only)
+    else:
+        extract_cases(args.cases_file, args.output_folder, args.jobs, args.memory, worker_command, matchers, version, args.only)
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+
+import os
+import glob
+import filecmp
+import shutil
+import asyncio
+import subprocess
+import vcs
+import metadata
+import journal
+import blobstore
+
+BEFORE_FOLDER_NAME = "before"
+AFTER_FOLDER_NAME = "after"
+
+class ExtractionError(Exception):
+    """
+    A failed step of the extraction of a bug, with the command and its output when there is one.
+    """
+
+    def __init__(self, step, message, command=None, returncode=None, output=None):
+        super().__init__(f"{step}: {message}")
+        self.step = step
+        self.message = message
+        self.command = command
+        self.returncode = returncode
+        self.output = output
+
+    def report(self, dataset, project, bug):
+        return {"dataset": dataset, "project": project, "bug": str(bug), "step": self.step, "message": self.message,
+                "command": self.command, "returncode": self.returncode, "output": self.output}
+
+class Backend:
+    """
+    A bug dataset. Subclasses list the projects and bugs of the dataset and check out the
+    buggy (before) and fixed (after) versions of a bug. Files with the extension that differ
+    between the two versions are extracted by the Extraction engine.
+    """
+    name = None
+    extension = None
+
+    def __init__(self, concurrency=1, metadata_cache=None):
+        self.concurrency = concurrency
+        self.metadata_cache = metadata_cache
+        # Bugs of a project go through a single working tree when set, only projects run concurrently
+        self.incremental = False
+
+    def projects(self):
+        raise NotImplementedError
+
+    def bug_catalogue(self, project):
+        """
+        Return a dict of the active bugs of a project, keyed by bug id.
+        """
+        raise NotImplementedError
+
+    def active_bugs(self, project):
+        return list(self.bug_catalogue(project))
+
+    async def checkout(self, project, bug, version, work_path):
+        """
+        Check out the BEFORE_FOLDER_NAME or AFTER_FOLDER_NAME version of a bug in work_path,
+        and return the root of the checkout.
+        """
+        raise NotImplementedError
+
+    async def release(self, project, work_path):
+        pass
+
+    def before_revision(self, project, bug):
+        """
+        Name of the before version inside the after checkout, used to ask git for the changed files.
+        """
+        return None
+
+    async def changed_contents(self, project, bug, working_tree):
+        """
+        Return the (path, before content, after content) of the changed files of a bug without
+        checking out both versions, or None when the backend cannot.
+        """
+        return None
+
+async def run_command(step, command):
+    """
+    Run a command without blocking the event loop, raise an ExtractionError when it fails.
+    """
+    try:
+        process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+    except OSError as error:
+        raise ExtractionError(step, str(error), command)
+    output, _ = await process.communicate()
+    output = output.decode("UTF-8", errors="replace")
+    if process.returncode != 0:
+        raise ExtractionError(step, f"exited with code {str(process.returncode)}", command, process.returncode, output[-4000:])
+    return output
+
+async def run_git(step, function, *arguments):
+    """
+    Run one of the blocking vcs functions in a thread, raise an ExtractionError when git fails.
+    """
+    try:
+        return await asyncio.to_thread(function, *arguments)
+    except subprocess.CalledProcessError as error:
+        raise ExtractionError(step, f"exited with code {str(error.returncode)}", error.cmd, error.returncode)
+
+class Extraction:
+    """
+    Extract the changed files of the bugs of a backend into out_path/{before,after}/<project>/<bug>.
+    The backend runs at most backend.concurrency bugs at once, in scratch trees of tmp_path.
+    The output tree and the journal belong to a single dataset, one Extraction runs one backend.
+    """
+
+    def __init__(self, out_path, tmp_path, compare_backend="git", journal_file=None, blob_store=None, adopt_existing=False):
+        self.out_path = out_path
+        self.tmp_path = tmp_path
+        self.compare_backend = compare_backend
+        self.journal_file = journal_file if journal_file != None else f"{out_path}/.journal.json"
+        self.blob_store = blob_store
+        self.adopt_existing = adopt_existing
+        self.failures = []
+
+    def run(self, backend):
+        asyncio.run(self.extract_backend(backend))
+        if len(self.failures) > 0:
+            errors_file = f"{self.tmp_path}/extraction-errors.json"
+            metadata.write_json(errors_file, self.failures)
+            print(f"{str(len(self.failures))} extraction steps failed, see {errors_file}")
+        return self.failures
+
+    async def extract_backend(self, backend):
+        print(f"Starting checkout of {backend.name}")
+        print("Projects : ")
+        print(backend.projects())
+        # Every worker owns a scratch tree under tmp_path, so checkouts never overlap
+        scratch_paths = asyncio.Queue()
+        for worker in range(backend.concurrency):
+            scratch_paths.put_nowait(f"{self.tmp_path}/{backend.name}-worker-{str(worker)}")
+
+        async def run(bugs):
+            scratch_path = await scratch_paths.get()
+            try:
+                for project, bug in bugs:
+                    await self.process_bug(backend, project, bug, scratch_path)
+            finally:
+                scratch_paths.put_nowait(scratch_path)
+
+        catalogues = await asyncio.gather(*(self.active_bugs(backend, project) for project in backend.projects()))
+        if backend.incremental:
+            tasks = [[(project, bug) for bug in bugs] for project, bugs in zip(backend.projects(), catalogues)]
+        else:
+            tasks = [[(project, bug)] for project, bugs in zip(backend.projects(), catalogues) for bug in bugs]
+        print(f"Found {str(sum(len(bugs) for bugs in catalogues))} active bugs, using {str(backend.concurrency)} workers")
+        await asyncio.gather(*(run(bugs) for bugs in tasks))
+
+    async def active_bugs(self, backend, project):
+        try:
+            return await asyncio.to_thread(backend.active_bugs, project)
+        except Exception as error:
+            print(f"Cannot list the bugs of {project}, skipping")
+            self.failures.append(ExtractionError("catalogue", str(error)).report(backend.name, project, None))
+            return []
+
+    async def process_bug(self, backend, project, bug, scratch_path):
+        """
+        Extract a bug, recording its failure instead of aborting the other bugs.
+        """
+        try:
+            await self.extract_bug(backend, project, bug, scratch_path)
+        except ExtractionError as error:
+            print(f"Bug {project}-{str(bug)} failed at {error.step}, it will be extracted again")
+            self.failures.append(error.report(backend.name, project, bug))
+        except OSError as error:
+            print(f"Bug {project}-{str(bug)} failed, it will be extracted again")
+            self.failures.append(ExtractionError("copy", str(error)).report(backend.name, project, bug))
+        except Exception as error:
+            # Broken metadata, such as a missing key or a corrupted cache, only fails this bug
+            print(f"Bug {project}-{str(bug)} failed, it will be extracted again")
+            self.failures.append(ExtractionError(type(error).__name__, str(error)).report(backend.name, project, bug))
+
+    async def extract_bug(self, backend, project, bug, scratch_path):
+        print(f"Checking bug {project}-{str(bug)}")
+
+        bug_before_path = f"{self.out_path}/{BEFORE_FOLDER_NAME}/{project}/{str(bug)}"
+        bug_after_path = f"{self.out_path}/{AFTER_FOLDER_NAME}/{project}/{str(bug)}"
+
+        bug_key = f"{project}/{str(bug)}"
+        if journal.state(self.journal_file, bug_key) == journal.VERIFIED:
+            print(f"Bug {project}-{str(bug)} already processed, skipping")
+            return
+
+        if str(bug) not in backend.bug_catalogue(project):
+            print(f"Bug {project}-{str(bug)} is deprecated, skipping")
+            return
+
+        if self.adopt_existing and journal.state(self.journal_file, bug_key) == None and (os.path.exists(bug_before_path) or os.path.exists(bug_after_path)):
+            # Extracted before the journal existed, trusted without verification on request only
+            await asyncio.to_thread(journal.record, self.journal_file, bug_key, journal.VERIFIED)
+            print(f"Bug {project}-{str(bug)} already processed, skipping")
+            return
+
+        if not await asyncio.to_thread(journal.claim, self.journal_file, bug_key):
+            print(f"Bug {project}-{str(bug)} is handled by another run, skipping")
+            return
+
+        # Drop the leftovers of an interrupted run
+        await asyncio.to_thread(reset_folder, bug_before_path)
+        await asyncio.to_thread(reset_folder, bug_after_path)
+        changed_contents = await backend.changed_contents(project, bug, f"{scratch_path}/{project}")
+        if changed_contents == None:
+            changed_files = await self.checkout_changes(backend, project, bug, scratch_path)
+        else:
+            await asyncio.to_thread(journal.record, self.journal_file, bug_key, journal.CHECKED_OUT)
+            changed_files = await asyncio.to_thread(self.write_changes, changed_contents, bug_before_path, bug_after_path)
+        await asyncio.to_thread(journal.record, self.journal_file, bug_key, journal.COPIED)
+        if await asyncio.to_thread(self.verify, changed_files, bug_before_path, bug_after_path):
+            await asyncio.to_thread(journal.record, self.journal_file, bug_key, journal.VERIFIED, files=[changed_file[0].replace('/','_') for changed_file in changed_files])
+        else:
+            raise ExtractionError("verify", "the copies differ from the checkout")
+
+    async def checkout_changes(self, backend, project, bug, scratch_path):
+        """
+        Check out both versions of a bug, copy the changed files and return them as
+        (path, before content, after content), contents being read back only for verification.
+        """
+        bug_key = f"{project}/{str(bug)}"
+        bug_before_path = f"{self.out_path}/{BEFORE_FOLDER_NAME}/{project}/{str(bug)}"
+        bug_after_path = f"{self.out_path}/{AFTER_FOLDER_NAME}/{project}/{str(bug)}"
+        # Checkouts start from an empty scratch tree
+        await asyncio.to_thread(shutil.rmtree, f"{scratch_path}/{BEFORE_FOLDER_NAME}", ignore_errors=True)
+        await asyncio.to_thread(shutil.rmtree, f"{scratch_path}/{AFTER_FOLDER_NAME}", ignore_errors=True)
+        before_root = await backend.checkout(project, bug, BEFORE_FOLDER_NAME, f"{scratch_path}/{BEFORE_FOLDER_NAME}")
+        after_root = await backend.checkout(project, bug, AFTER_FOLDER_NAME, f"{scratch_path}/{AFTER_FOLDER_NAME}")
+        try:
+            await asyncio.to_thread(journal.record, self.journal_file, bug_key, journal.CHECKED_OUT)
+            changed_files = await asyncio.to_thread(compare, before_root, after_root, backend.extension, self.compare_backend, backend.before_revision(project, bug))
+            for changed_file in changed_files:
+                print(f"Copying {str(changed_file)}")
+                await asyncio.to_thread(self.copy_file, changed_file[1], f"{bug_before_path}/{changed_file[0].replace('/','_')}")
+                await asyncio.to_thread(self.copy_file, changed_file[2], f"{bug_after_path}/{changed_file[0].replace('/','_')}")
+            return await asyncio.to_thread(read_changes, changed_files)
+        finally:
+            await backend.release(project, f"{scratch_path}/{BEFORE_FOLDER_NAME}")
+            await backend.release(project, f"{scratch_path}/{AFTER_FOLDER_NAME}")
+
+    def write_changes(self, changed_contents, bug_before_path, bug_after_path):
+        for changed_file in changed_contents:
+            print(f"Writing {changed_file[0]}")
+            self.write_file(changed_file[1], f"{bug_before_path}/{changed_file[0].replace('/','_')}")
+            self.write_file(changed_file[2], f"{bug_after_path}/{changed_file[0].replace('/','_')}")
+        return changed_contents
+
+    def verify(self, changed_files, bug_before_path, bug_after_path):
+        return all(read_file(f"{bug_before_path}/{changed_file[0].replace('/','_')}") == changed_file[1]
+                   and read_file(f"{bug_after_path}/{changed_file[0].replace('/','_')}") == changed_file[2]
+                   for changed_file in changed_files)
+
+    def copy_file(self, source, dest):
+        if self.blob_store == None:
+            shutil.copyfile(source, dest)
+        else:
+            blobstore.copy(self.blob_store, source, dest)
+
+    def write_file(self, content, dest):
+        if self.blob_store == None:
+            with open(dest, 'wb') as f:
+                f.write(content)
+        else:
+            blobstore.write(self.blob_store, content, dest)
+
+def reset_folder(path):
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+def read_changes(changed_files):
+    return [(changed_file[0], read_file(changed_file[1]), read_file(changed_file[2])) for changed_file in changed_files]
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def compare(before, after, extension, backend="git", before_revision=None):
+    comparison = []
+    candidates = None
+    if backend == "git":
+        candidates = vcs.changed_paths(before, after, extension, before_revision)
+    if candidates == None:
+        candidates = [file[len(before) + 1:] for file in glob.glob(f"{before}/**/*{extension}", recursive = True)]
+    for base in candidates:
+        file = f"{before}/{base}"
+        other = f"{after}/{base}"
+        if os.path.exists(file) and os.path.exists(other):
+            if filecmp.cmp(file, other) == False:
+                comparison.append((base, file, other))
+    return comparison
+
+def add_arguments(parser):
+    """
+    Add the command line options shared by the extraction scripts.
+    """
+    parser.add_argument("out_path", help="folder receiving the before and after files")
+    parser.add_argument("tmp_path", help="scratch folder for the checkouts")
+    parser.add_argument("--jobs", type=int, default=1, help="number of bugs extracted concurrently")
+    parser.add_argument("--compare", choices=["git", "filecmp"], default="git", help="how changed files are detected, git falls back to filecmp when needed")
+    parser.add_argument("--metadata-cache", help="JSON file caching the bug catalogues, defaults to tmp_path/<dataset>-metadata.json")
+    parser.add_argument("--journal", help="JSON journal of the bug states, defaults to out_path/.journal.json")
+    parser.add_argument("--blob-store", help="content-addressed store, the extracted files become hardlinks to its blobs")
+    parser.add_argument("--adopt-existing", action="store_true", help="record the bugs already in out_path but not in the journal as verified instead of extracting them again")
+
+def from_arguments(args):
+    return Extraction(args.out_path, args.tmp_path, args.compare, args.journal, args.blob_store, args.adopt_existing)
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Stand-in for GumTreeWorker.java speaking the same protocol, to try extract_cases.py without
+Java or GumTree: extract_cases.py --worker-command "python3 fake_gumtree_worker.py" ...
+The html it writes only lists the job, and its edit scripts are a single update of the root.
+A job whose before file is named crash makes it exit without replying, like a dead JVM.
+"""
+
+import os
+import sys
+import json
+
+if __name__ == '__main__':
+    for line in sys.stdin:
+        before, after, generator, *renderings = line.rstrip("\n").split("\t")
+        if os.path.basename(before) == "crash":
+            sys.exit(1)
+        statuses = []
+        for matcher, output_file in zip(renderings[0::2], renderings[1::2]):
+            if not os.path.exists(before) or not os.path.exists(after):
+                statuses.append(f"error java.io.FileNotFoundException: {before if not os.path.exists(before) else after}")
+                continue
+            if output_file == "-":
+                root = ["root", before, 0, os.path.getsize(before)]
+                statuses.append("ok " + json.dumps({"mappings": [[root, ["root", after, 0, os.path.getsize(after)]]],
+                                                    "actions": [{"action": "update-node", "tree": root, "label": after}]}))
+                continue
+            with open(output_file, 'w') as f:
+                f.write(f"<html><body>{before} {after} {matcher or 'default'} {generator or 'default'}</body></html>\n")
+            statuses.append("ok")
+        print("\t".join(statuses), flush=True)
@@ -2,6 +2,15 @@
 
 import os
 import glob
+import json
+import argparse
+import random
+import shutil
+import tempfile
+import vcs
+import metadata
+import normalize
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pydriller import Repository
 
 from bugsinpy import AFTER_FOLDER_NAME, BEFORE_FOLDER_NAME
@@ -15,35 +24,322 @@ GH_JAVA_PATH = "gh-java"
 GH_PYTHON_PROJECTS = {'black': 'https://github.com/psf/black.git', 'scikit-learn': 'https://github.com/scikit-learn/scikit-learn.git', 'wagtail': 'https://github.com/wagtail/wagtail.git', 'home-assitant': 'https://github.com/wagtail/wagtail.git', 'textual': 'https://github.com/Textualize/textual.git', 'pyxel': 'https://github.com/kitao/pyxel.git', 'django': 'https://github.com/django/django.git', 'keras': 'https://github.com/keras-team/keras.git', 'ansible': 'https://github.com/ansible/ansible.git', 'requests': 'https://github.com/psf/requests.git'}
 GH_PYTHON_PATH = "gh-python"
 
-def handle_projects(projects, extension, base_dir, max_files=100):
+TIME_STRATA = 4
+SIZE_STRATA = 3
+
+def handle_projects(projects, extension, base_dir, max_files=100, jobs=1, backend="pydriller", clone_path=None, seed=None, update=False):
     print(f"Handle {extension} projects in {base_dir}")
-    for project in projects:
-        already_performed = len(glob.glob(r'' + base_dir + '/before/' + project + '/**/*' + extension, recursive=True))
-        if already_performed >= max_files:
-            print(f"Already enough files in project {project}")
+    if jobs == 1:
+        for project in projects:
+            handle_project(project, projects[project], extension, base_dir, max_files, backend, clone_path, seed, update)
+        return
+
+    # Projects are independent, each one is mined by its own process
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(handle_project, project, projects[project], extension, base_dir, max_files, backend, clone_path, seed, update): project for project in projects}
+        for future in as_completed(futures):
+            project = futures[future]
+            try:
+                print(f"[{project}] Done with {str(future.result())} files")
+            except Exception as error:
+                print(f"[{project}] Failed: {str(error)}")
+
+def handle_project(project, url, extension, base_dir, max_files, backend="pydriller", clone_path=None, seed=None, update=False):
+    if seed != None:
+        return sample_project(project, url, extension, base_dir, max_files, seed, clone_path)
+    manifest = read_manifest(project, extension, base_dir)
+    if update:
+        return update_project(project, url, extension, base_dir, max_files, backend, clone_path, manifest)
+    if manifest.get("high_water_mark") == None:
+        # Set before anything else, so that a project with enough files can still be updated
+        manifest["high_water_mark"] = initial_mark(project, url, backend, clone_path, manifest)
+        write_manifest(project, base_dir, manifest)
+    if len(manifest["files"]) >= max_files:
+        log(project, f"Already enough files in project {project}")
+        return len(manifest["files"])
+
+    log(project, f"Starting gathering files in {project}")
+    return mine_commits(project, url, extension, base_dir, max_files, backend, clone_path, manifest, "last_commit")
+
+def update_project(project, url, extension, base_dir, max_files, backend, clone_path, manifest):
+    """
+    Mine up to max_files new files in the commits after the high water mark of the project,
+    then move the mark forward. Only the history newer than the previous runs is walked.
+    """
+    if manifest.get("high_water_mark") == None:
+        if manifest["last_commit"] == None and len(manifest["files"]) == 0:
+            log(project, f"Nothing mined yet in project {project}, mine it before updating it")
+            return 0
+        # Manifests older than the update mode only know the last commit reached
+        manifest["high_water_mark"] = manifest["last_commit"] or initial_mark(project, url, backend, clone_path, manifest)
+    if backend == "git":
+        vcs.update_mirror(local_clone(project, url, clone_path))
+    log(project, f"Updating {project} since {manifest['high_water_mark']}")
+    mined_files = len(manifest["files"])
+    return mine_commits(project, url, extension, base_dir, mined_files + max_files, backend, clone_path, manifest, "high_water_mark") - mined_files
+
+def mine_commits(project, url, extension, base_dir, max_files, backend, clone_path, manifest, position):
+    """
+    Gather files from the commits after the commit stored under position in the manifest, until
+    the project has max_files files, and move position forward as commits are consumed.
+    """
+    gathered_files = len(manifest["files"])
+    harvested = set((entry["commit"], entry["filename"]) for entry in manifest["files"])
+    seen_changes = set(entry["hash"] for entry in manifest["files"] if "hash" in entry)
+    # Resume from the last commit reached instead of walking the history from its start
+    if backend == "git":
+        commits = git_commits(project, url, extension, manifest[position], clone_path)
+    else:
+        commits = pydriller_commits(url, extension, manifest[position])
+    for commit_hash, file_names, fetch in commits:
+        if gathered_files >= max_files:
+            break
+
+        # Choose the files to keep before reading any content
+        candidates = []
+        for index, file_name in enumerate(file_names):
+            if (commit_hash, file_name) not in harvested and file_name not in [file_names[other] for other in candidates]:
+                candidates.append(index)
+        processed = 0
+        while processed < len(candidates) and gathered_files < max_files:
+            # Fetch what the budget still needs, the next candidates replace the files filtered out
+            selected = candidates[processed:processed + max_files - gathered_files]
+            processed += len(selected)
+            for index, (source_code_before, source_code) in zip(selected, fetch(selected)):
+                if source_code_before == None or source_code == None:
+                    continue
+                change_hash = filter_change(source_code_before, source_code, extension, seen_changes)
+                if change_hash != None:
+                    write_pair(base_dir, project, commit_hash, file_names[index], source_code_before, source_code)
+                    harvested.add((commit_hash, file_names[index]))
+                    manifest["files"].append({"commit": commit_hash, "filename": file_names[index], "hash": change_hash})
+                    gathered_files += 1
+        # A commit cut by the budget is resumed from its start
+        if processed == len(candidates):
+            manifest[position] = commit_hash
+        write_manifest(project, base_dir, manifest)
+        log(project, f"Gathered {str(gathered_files)} in project {project}")
+    commits.close()
+    return gathered_files
+
+def initial_mark(project, url, backend, clone_path, manifest):
+    """
+    Return the high water mark of a project without one. Commits after the current head are left
+    to the update mode, except for trees mined before manifests existed, which are updated from
+    their newest harvested commit when the local clone knows it.
+    """
+    if backend == "git" and manifest["last_commit"] == None and len(manifest["files"]) > 0:
+        newest = vcs.newest_commit(local_clone(project, url, clone_path), sorted(set(entry["commit"] for entry in manifest["files"])))
+        if newest != None:
+            return newest
+    return project_head(project, url, backend, clone_path)
+
+def project_head(project, url, backend, clone_path):
+    if backend == "git":
+        return vcs.git(local_clone(project, url, clone_path), "rev-parse", "HEAD").strip()
+    return vcs.remote_head(url)
+
+def filter_change(source_code_before, source_code, extension, seen_changes):
+    """
+    Return the normalized hash of a change, or None if the change only touches whitespace or
+    comments, or if a change with the same normalized contents was already kept.
+    """
+    change_hash = normalize.pair_hash(source_code_before, source_code, extension)
+    if change_hash == None or change_hash in seen_changes:
+        return None
+    seen_changes.add(change_hash)
+    return change_hash
+
+def write_pair(base_dir, project, commit_hash, file_name, source_code_before, source_code):
+    before_dir = f"{base_dir}/{BEFORE_FOLDER_NAME}/{project}/{commit_hash}"
+    after_dir = f"{base_dir}/{AFTER_FOLDER_NAME}/{project}/{commit_hash}"
+    os.makedirs(before_dir, exist_ok=True)
+    os.makedirs(after_dir, exist_ok=True)
+    with open(f"{before_dir}/{file_name}", 'wb') as f:
+        f.write(source_code_before)
+    with open(f"{after_dir}/{file_name}", 'wb') as f:
+        f.write(source_code)
+
+def pydriller_commits(url, extension, last_commit):
+    """
+    Yield (commit hash, file names, fetch) for the commits after last_commit, fetch returning the
+    (before, after) contents of the selected file indexes. Pydriller computes a diff per file.
+    """
+    for commit in Repository(url, from_commit=last_commit, only_no_merge=True, only_modifications_with_file_types=[extension]).traverse_commits():
+        if commit.hash == last_commit:
             continue
-        
-        print(f"Starting gathering files in {project}")
-        gathered_files = 0
-        for commit in Repository(projects[project], only_no_merge=True, only_modifications_with_file_types=[extension]).traverse_commits():
-            if gathered_files >= max_files:
+        files = [file for file in commit.modified_files if file.filename.endswith(extension)]
+        yield commit.hash, [file.filename for file in files], lambda selected, files=files: [encode_sources(files[index]) for index in selected]
+
+def encode_sources(file):
+    if file.source_code_before == None or file.source_code == None:
+        return (None, None)
+    return (file.source_code_before.encode("UTF-8"), file.source_code.encode("UTF-8"))
+
+def git_commits(project, url, extension, last_commit, clone_path):
+    """
+    Same as pydriller_commits from a local bare clone: git log lists the modified files with their
+    blob ids, and only the selected blobs are read, in bulk, by a single git cat-file process.
+    """
+    repository = local_clone(project, url, clone_path)
+    revisions = "HEAD" if last_commit == None else f"{last_commit}..HEAD"
+    with vcs.CatFileBatch(repository) as reader:
+        for commit_hash, _, changes in vcs.log_changes(repository, revisions, extension):
+            # Modifications only, additions and deletions have no before or after content
+            changes = [change for change in changes if change[0] == "M"]
+
+            def fetch(selected, changes=changes):
+                contents = reader.read_many([blob for index in selected for blob in changes[index][2:4]])
+                return list(zip(contents[0::2], contents[1::2]))
+
+            yield commit_hash, [os.path.basename(change[1]) for change in changes], fetch
+
+def local_clone(project, url, clone_path):
+    if clone_path == None:
+        clone_path = f"{tempfile.gettempdir()}/gh-benchs"
+    repository = f"{clone_path}/{project}.git"
+    if not os.path.exists(repository):
+        log(project, f"Cloning {url}")
+        os.makedirs(clone_path, exist_ok=True)
+        vcs.clone_mirror(url, repository)
+    return repository
+
+def sample_project(project, url, extension, base_dir, sample_size, seed, clone_path):
+    """
+    Write a seeded sample of sample_size modified files of the whole history of a project, stratified
+    by commit time and by number of changed lines, to its own tree <base_dir>-sample-<seed>. The files
+    already mined in base_dir are left out. Only the blobs of the drawn files are read.
+    """
+    repository = local_clone(project, url, clone_path)
+    manifest = read_manifest(project, extension, base_dir)
+    harvested = set((entry["commit"], entry["filename"]) for entry in manifest["files"])
+    modifications = [modification for modification in commit_index(project, repository, extension)
+                     if (modification["commit"], modification["filename"]) not in harvested]
+    sample_dir = sample_path(base_dir, seed)
+    # A new draw with the same seed replaces the previous one instead of adding to it
+    for folder in [BEFORE_FOLDER_NAME, AFTER_FOLDER_NAME]:
+        shutil.rmtree(f"{sample_dir}/{folder}/{project}", ignore_errors=True)
+    sample_manifest = {"files": [], "last_commit": None, "seed": seed, "size": sample_size}
+    seen_changes = set(entry["hash"] for entry in manifest["files"] if "hash" in entry)
+    with vcs.CatFileBatch(repository) as reader:
+
+        def keep(modification):
+            source_code_before, source_code = reader.read_many([modification["old_blob"], modification["new_blob"]])
+            change_hash = filter_change(source_code_before, source_code, extension, seen_changes)
+            if change_hash == None:
+                return False
+            write_pair(sample_dir, project, modification["commit"], modification["filename"], source_code_before, source_code)
+            sample_manifest["files"].append({"commit": modification["commit"], "filename": modification["filename"], "hash": change_hash})
+            return True
+
+        kept = len(stratified_sample(modifications, sample_size, seed, keep))
+    log(project, f"Sampled {str(kept)} non trivial files of the {str(sample_size)} requested among {str(len(modifications))} modified files with seed {str(seed)} in {sample_dir}")
+    write_manifest(project, sample_dir, sample_manifest)
+    return kept
+
+def sample_path(base_dir, seed):
+    return f"{base_dir}-sample-{str(seed)}"
+
+def commit_index(project, repository, extension):
+    """
+    Return the modified files of the history of a repository with their commit time and changed lines,
+    from one git log --raw --numstat. The index is kept next to the clone until its HEAD moves.
+    """
+    index_file = f"{repository}/gh-benchs-index{extension}.json"
+    head = vcs.git(repository, "rev-parse", "HEAD").strip()
+    if os.path.exists(index_file):
+        with open(index_file) as f:
+            index = json.load(f)
+        if index["head"] == head:
+            return index["modifications"]
+    log(project, f"Indexing the history of {project}")
+    modifications = []
+    for commit_hash, commit_time, changes in vcs.log_changes(repository, head, extension, numstat=True):
+        file_names = set()
+        for status, path, old_blob, new_blob, changed_lines in changes:
+            # One file per name and commit, as the commit folders are flat
+            if status == "M" and os.path.basename(path) not in file_names:
+                file_names.add(os.path.basename(path))
+                modifications.append({"commit": commit_hash, "time": commit_time, "filename": os.path.basename(path),
+                                      "old_blob": old_blob, "new_blob": new_blob, "lines": changed_lines or 0})
+    metadata.write_json(index_file, {"head": head, "modifications": modifications})
+    return modifications
+
+def stratified_sample(modifications, sample_size, seed, keep=lambda modification: True):
+    """
+    Draw sample_size modifications, spread over TIME_STRATA commit time strata crossed with
+    SIZE_STRATA changed lines strata, in proportion to the size of each stratum. A modification
+    rejected by keep is replaced by another one of its stratum, until the allocation of the
+    stratum is filled or the stratum runs out.
+    """
+    if sample_size >= len(modifications):
+        return [modification for modification in modifications if keep(modification)]
+    generator = random.Random(seed)
+    time_ranks = rank(modifications, "time")
+    size_ranks = rank(modifications, "lines")
+    strata = {}
+    for position, modification in enumerate(modifications):
+        stratum = (time_ranks[position] * TIME_STRATA // len(modifications), size_ranks[position] * SIZE_STRATA // len(modifications))
+        strata.setdefault(stratum, []).append(position)
+    # Largest remainder allocation of the sample to the strata
+    quotas = {stratum: sample_size * len(members) / len(modifications) for stratum, members in strata.items()}
+    allocation = {stratum: int(quota) for stratum, quota in quotas.items()}
+    remaining = sample_size - sum(allocation.values())
+    for stratum in sorted(quotas, key=lambda stratum: (allocation[stratum] - quotas[stratum], stratum))[:remaining]:
+        allocation[stratum] += 1
+    sample = []
+    for stratum in sorted(strata):
+        kept = 0
+        # Members in a random order, the ones after the allocation being the replacements
+        for position in generator.sample(strata[stratum], len(strata[stratum])):
+            if kept == allocation[stratum]:
                 break
+            if keep(modifications[position]):
+                sample.append(position)
+                kept += 1
+    return [modifications[position] for position in sorted(sample)]
+
+def rank(modifications, key):
+    ranks = [0] * len(modifications)
+    for position_rank, position in enumerate(sorted(range(len(modifications)), key=lambda position: modifications[position][key])):
+        ranks[position] = position_rank
+    return ranks
+
+def manifest_path(project, base_dir):
+    return f"{base_dir}/.mining/{project}.json"
+
+def read_manifest(project, extension, base_dir):
+    """
+    Return the mining manifest of a project: the files already harvested and the last commit reached.
+    Trees mined before manifests existed are scanned once to build it.
+    """
+    if os.path.exists(manifest_path(project, base_dir)):
+        with open(manifest_path(project, base_dir)) as f:
+            return json.load(f)
+    files = []
+    for file in sorted(glob.glob(r'' + base_dir + '/before/' + project + '/**/*' + extension, recursive=True)):
+        files.append({"commit": os.path.basename(os.path.dirname(file)), "filename": os.path.basename(file)})
+    manifest = {"files": files, "last_commit": None}
+    write_manifest(project, base_dir, manifest)
+    return manifest
+
+def write_manifest(project, base_dir, manifest):
+    metadata.write_json(manifest_path(project, base_dir), manifest)
 
-            for file in commit.modified_files:
-                if gathered_files < max_files and file.filename.endswith(extension) and file.source_code_before != None and file.source_code != None:
-                    before_dir = f"{base_dir}/{BEFORE_FOLDER_NAME}/{project}/{commit.hash}"
-                    after_dir = f"{base_dir}/{AFTER_FOLDER_NAME}/{project}/{commit.hash}"
-                    os.makedirs(before_dir, exist_ok=True)
-                    os.makedirs(after_dir, exist_ok=True)
-                    clean_file_name = file.filename
-                    if not (os.path.exists(f"{before_dir}/{clean_file_name}") or os.path.exists(f"{after_dir}/{clean_file_name}")):
-                        with open(f"{before_dir}/{clean_file_name}", 'w') as f:
-                            f.write(file.source_code_before)
-                        with open(f"{after_dir}/{clean_file_name}", 'w') as f:
-                            f.write(file.source_code)
-                        gathered_files += 1
-            print(f"Gathered {str(gathered_files)} in project {project}")
+def log(project, message):
+    # Lines of concurrent projects interleave, prefix them with the project
+    print(f"[{project}] {message}", flush=True)
 
 if __name__ == '__main__':
-    handle_projects(GH_JAVA_PROJECTS, ".java", GH_JAVA_PATH)
-    handle_projects(GH_PYTHON_PROJECTS, ".py", GH_PYTHON_PATH)
+    parser = argparse.ArgumentParser(description="Mine the GitHub Java and Python datasets.")
+    parser.add_argument("--jobs", type=int, default=1, help="number of projects mined concurrently")
+    parser.add_argument("--max-files", type=int, default=100, help="number of files gathered per project")
+    parser.add_argument("--backend", choices=["pydriller", "git"], default="pydriller", help="git lists changes with git log and reads blobs with git cat-file")
+    parser.add_argument("--clone-path", help="folder of the local clones used by the git backend")
+    parser.add_argument("--sample-seed", type=int, help="write a stratified random sample of max-files files per project to <dataset>-sample-<seed>, drawn with this seed from an index of the whole history")
+    parser.add_argument("--update", action="store_true", help="mine max-files new files per project in the commits newer than the previous runs")
+    args = parser.parse_args()
+    if args.update and args.sample_seed != None:
+        parser.error("--update and --sample-seed are exclusive")
+    handle_projects(GH_JAVA_PROJECTS, ".java", GH_JAVA_PATH, args.max_files, args.jobs, args.backend, args.clone_path, args.sample_seed, args.update)
+    handle_projects(GH_PYTHON_PROJECTS, ".py", GH_PYTHON_PATH, args.max_files, args.jobs, args.backend, args.clone_path, args.sample_seed, args.update)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import queue
+import threading
+import subprocess
+
+WORKER_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "GumTreeWorker.java")
+# GumTree release whose API GumTreeWorker.java is written against
+GUMTREE_RELEASE = "3.0.0"
+
+def worker_command(gumtree_home, memory=None):
+    """
+    Return the command running GumTreeWorker.java with the jars of a GumTree distribution.
+    """
+    command = ["java"]
+    if memory != None:
+        command.append(f"-Xmx{memory}")
+    return command + ["-cp", f"{gumtree_home}/lib/*", WORKER_SOURCE]
+
+def gumtree_version(gumtree_home):
+    """
+    Return a fingerprint of a GumTree distribution made of the names of its jars, which carry
+    their versions, or None if it has no lib folder.
+    """
+    if not os.path.isdir(f"{gumtree_home}/lib"):
+        return None
+    return " ".join(sorted(name for name in os.listdir(f"{gumtree_home}/lib") if name.endswith(".jar")))
+
+def gumtree_release(gumtree_home):
+    """
+    Return the version of the core jar of a GumTree distribution, or None if it has none.
+    """
+    if not os.path.isdir(f"{gumtree_home}/lib"):
+        return None
+    for name in os.listdir(f"{gumtree_home}/lib"):
+        match = re.fullmatch(r"core-(.+)\.jar", name)
+        if match:
+            return match.group(1)
+    return None
+
+class GumTreeWorker:
+    """
+    A long-lived worker process, started on the first job. A job is a (before, after, generator,
+    renderings) tuple, renderings being a list of (matcher, output file), None selecting the
+    default generator or matcher. The worker parses the files of a job once for all its matchers.
+    A rendering to the output file - returns the JSON of its mappings and edit script instead.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self.process = None
+
+    def diff(self, before, after, generator, renderings):
+        """
+        Render the renderings of a job, and return their (error, edits) results, the error being
+        None for the renderings that succeeded and the edits the JSON text of the - renderings.
+        """
+        if self.process == None:
+            try:
+                self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, encoding="UTF-8")
+            except OSError as error:
+                return [(f"worker cannot start: {str(error)}", None)] * len(renderings)
+        fields = [before, after, generator or ""]
+        for matcher, output_file in renderings:
+            fields += [matcher or "", output_file]
+        try:
+            self.process.stdin.write("\t".join(fields) + "\n")
+            self.process.stdin.flush()
+            reply = self.process.stdout.readline()
+        except BrokenPipeError:
+            reply = ""
+        if reply == "":
+            # The worker died on this job, the next job starts a new one
+            self.close()
+            return [("worker exited", None)] * len(renderings)
+        statuses = reply.rstrip("\n").split("\t")
+        if len(statuses) != len(renderings):
+            # Out of step with the protocol, the results cannot be matched with the renderings
+            self.close()
+            return [(f"worker replied {str(len(statuses))} statuses for {str(len(renderings))} renderings", None)] * len(renderings)
+        results = []
+        for status in statuses:
+            status, _, message = status.partition(" ")
+            results.append((None, message or None) if status == "ok" else (message, None))
+        return results
+
+    def close(self):
+        if self.process == None:
+            return
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.process.wait()
+        self.process = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def run_jobs(command, jobs, workers=1):
+    """
+    Run the jobs on a pool of workers and return the (error, edits) results of their renderings.
+    Every job gets a result, even when its worker fails.
+    """
+    pending = queue.Queue()
+    for index, job in enumerate(jobs):
+        pending.put((index, job))
+    errors = [None] * len(jobs)
+
+    def work():
+        with GumTreeWorker(command) as worker:
+            while True:
+                try:
+                    index, job = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    errors[index] = worker.diff(*job)
+                except Exception as error:
+                    errors[index] = [(f"worker failed: {str(error)}", None)] * len(job[3])
+                    worker.close()
+
+    threads = [threading.Thread(target=work) for _ in range(min(workers, len(jobs)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for index, job in enumerate(jobs):
+        if errors[index] == None:
+            errors[index] = [("no worker ran the job", None)] * len(job[3])
+    return errors
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import fcntl
+import socket
+import threading
+from contextlib import contextmanager
+from metadata import write_json
+
+PENDING = "pending"
+CHECKED_OUT = "checked out"
+COPIED = "copied"
+VERIFIED = "verified"
+
+snapshots = {}
+snapshots_lock = threading.Lock()
+
+def state(journal_file, key):
+    """
+    Return the recorded state of key, or None if the journal does not know it.
+    The journal is read once per process, later changes come from record and claim.
+    """
+    with snapshots_lock:
+        if journal_file not in snapshots:
+            snapshots[journal_file] = read(journal_file)
+        entry = snapshots[journal_file].get(key)
+    return entry["state"] if entry != None else None
+
+def claim(journal_file, key):
+    """
+    Mark key as pending and owned by this process. Returns False when key is already verified
+    or when another live process on this host owns it. Entries left by dead processes are taken over.
+    """
+    with locked(journal_file) as entries:
+        entry = entries.get(key)
+        if entry != None and (entry["state"] == VERIFIED or owner_alive(entry.get("owner"))):
+            return False
+        entries[key] = {"state": PENDING, "owner": owner()}
+    return True
+
+def record(journal_file, key, new_state, **details):
+    """
+    Record the state of key, with optional details such as the copied files.
+    """
+    with locked(journal_file) as entries:
+        entry = {"state": new_state, "owner": owner() if new_state != VERIFIED else None}
+        entry.update(details)
+        entries[key] = entry
+
+@contextmanager
+def locked(journal_file):
+    """
+    Give the journal entries under an exclusive lock shared by threads and processes,
+    the entries are written back atomically on exit.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(journal_file)), exist_ok=True)
+    with open(f"{journal_file}.lock", 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            entries = read(journal_file)
+            yield entries
+            write_json(journal_file, entries)
+            with snapshots_lock:
+                snapshots[journal_file] = entries
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def read(journal_file):
+    if not os.path.exists(journal_file):
+        return {}
+    with open(journal_file) as f:
+        return json.load(f)
+
+def owner():
+    return {"host": socket.gethostname(), "pid": os.getpid()}
+
+def owner_alive(entry_owner):
+    if entry_owner == None:
+        return False
+    if entry_owner["host"] != socket.gethostname():
+        # Processes of other hosts cannot be checked, consider them alive
+        return True
+    if entry_owner["pid"] == os.getpid():
+        return False
+    try:
+        os.kill(entry_owner["pid"], 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
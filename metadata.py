@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import threading
+
+catalogues = {}
+catalogues_lock = threading.Lock()
+
+def catalogue(cache_file, project, sources, loader):
+    """
+    Return the bug catalogue of a project as built by loader(project).
+    The catalogue is loaded once per process and kept in cache_file, it is only rebuilt
+    when the modification time of one of the sources (files or folders) changed. sources may
+    be a function returning them, only called when the catalogue is not in memory yet.
+    """
+    with catalogues_lock:
+        if (cache_file, project) in catalogues:
+            return catalogues[(cache_file, project)]
+        if callable(sources):
+            sources = sources()
+        stamp = [os.path.getmtime(source) if os.path.exists(source) else None for source in sources]
+        entries = {}
+        if os.path.exists(cache_file):
+            with open(cache_file) as f:
+                entries = json.load(f)
+        if project not in entries or entries[project]["stamp"] != stamp:
+            print(f"Loading bug catalogue of {project}")
+            entries[project] = {"stamp": stamp, "bugs": loader(project)}
+            write_json(cache_file, entries)
+        catalogues[(cache_file, project)] = entries[project]["bugs"]
+        return entries[project]["bugs"]
+
+def write_json(path, content):
+    """
+    Write content as JSON through a temporary file renamed over path, so readers never see a partial file.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    partial = f"{path}.{str(os.getpid())}.{str(threading.get_ident())}.tmp"
+    with open(partial, 'w') as f:
+        json.dump(content, f)
+    os.replace(partial, path)
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+import io
+import re
+import hashlib
+import tokenize
+
+# String and character literals come first so that comment markers inside them are kept
+JAVA_TOKEN = re.compile(r'"""(?:\\.|[^\\])*?"""|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|//[^\n]*|/\*.*?\*/|\w+|\S', re.DOTALL)
+
+PYTHON_SKIPPED_TOKENS = {tokenize.COMMENT, tokenize.NL, tokenize.ENCODING, tokenize.ENDMARKER}
+PYTHON_LAYOUT_TOKENS = {tokenize.NEWLINE, tokenize.INDENT, tokenize.DEDENT}
+
+def tokens(content, extension):
+    """
+    Return the tokens of a source file without its comments and layout, so that two versions
+    differing only by whitespace or comments have the same tokens.
+    """
+    if extension == ".py":
+        try:
+            return python_tokens(content)
+        except (tokenize.TokenError, SyntaxError):
+            pass
+    return java_tokens(content)
+
+def python_tokens(content):
+    # Indentation is syntax in python, its levels are kept but not its width
+    return [tokenize.tok_name[token.type] if token.type in PYTHON_LAYOUT_TOKENS else token.string
+            for token in tokenize.tokenize(io.BytesIO(content).readline) if token.type not in PYTHON_SKIPPED_TOKENS]
+
+def java_tokens(content):
+    text = content.decode("UTF-8", errors="replace")
+    return [token for token in JAVA_TOKEN.findall(text) if not token.startswith("//") and not token.startswith("/*")]
+
+def fingerprint(content, extension):
+    return hashlib.sha256("\0".join(tokens(content, extension)).encode("UTF-8")).hexdigest()
+
+def pair_hash(source_code_before, source_code, extension):
+    """
+    Return the hash of the normalized before and after contents of a change, or None if the
+    change is trivial: both versions have the same tokens.
+    """
+    before_fingerprint = fingerprint(source_code_before, extension)
+    after_fingerprint = fingerprint(source_code, extension)
+    if before_fingerprint == after_fingerprint:
+        return None
+    return hashlib.sha256(f"{before_fingerprint}{after_fingerprint}".encode("UTF-8")).hexdigest()
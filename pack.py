@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+A pack is a single file holding every before/after file of some datasets:
+
+    MAGIC | entry data ... | zlib compressed JSON index | index offset, index length
+
+Each entry is either a zlib compressed file, or a zlib compressed line delta against
+another entry (its base), usually the previous version of the same file in the same
+project. The index maps (dataset, side, project, id, filename) to the entry location.
+"""
+
+import sys
+import os
+import glob
+import json
+import zlib
+import struct
+import difflib
+
+BEFORE_FOLDER_NAME = "before"
+AFTER_FOLDER_NAME = "after"
+
+MAGIC = b"GTDPACK1"
+TRAILER = ">QQ"
+MAX_DELTA_DEPTH = 8
+
+# Delta instructions: copy a range of lines of the base, or insert literal bytes
+COPY = b"C"
+INSERT = b"I"
+
+def build(archive, datasets):
+    entries = []
+    for dataset in datasets:
+        for path in glob.glob(f"{dataset}/{BEFORE_FOLDER_NAME}/*/*/*") + glob.glob(f"{dataset}/{AFTER_FOLDER_NAME}/*/*/*"):
+            if not os.path.isfile(path):
+                continue
+            side, project, id, filename = path[len(dataset) + 1:].split("/")
+            entries.append({"dataset": dataset, "side": side, "project": project, "id": id, "filename": filename})
+    # Successive versions of a file end up next to each other, the before version first
+    entries.sort(key=lambda entry: (entry["dataset"], entry["project"], entry["filename"], natural_key(entry["id"]), entry["side"] != BEFORE_FOLDER_NAME))
+
+    index = []
+    with open(archive, 'wb') as f:
+        f.write(MAGIC)
+        base = None
+        for entry in entries:
+            with open(entry_path(entry), 'rb') as source:
+                content = source.read()
+            if base != None and not same_file(base[0], entry):
+                base = None
+            data = zlib.compress(content, 9)
+            entry["base"] = None
+            entry["depth"] = 0
+            if base != None and base[0]["depth"] < MAX_DELTA_DEPTH:
+                delta_data = zlib.compress(delta(base[1], content), 9)
+                if len(delta_data) < len(data):
+                    data = delta_data
+                    entry["base"] = len(index) - 1
+                    entry["depth"] = base[0]["depth"] + 1
+            entry["offset"] = f.tell()
+            entry["length"] = len(data)
+            f.write(data)
+            index.append(entry)
+            base = (entry, content)
+        index_data = zlib.compress(json.dumps(index).encode("UTF-8"), 9)
+        index_offset = f.tell()
+        f.write(index_data)
+        f.write(struct.pack(TRAILER, index_offset, len(index_data)))
+    return index
+
+def same_file(entry, other):
+    return all(entry[key] == other[key] for key in ["dataset", "project", "filename"])
+
+def entry_path(entry):
+    return f"{entry['dataset']}/{entry['side']}/{entry['project']}/{entry['id']}/{entry['filename']}"
+
+def natural_key(id):
+    return (0, int(id), "") if id.isdigit() else (1, 0, id)
+
+def delta(base, content):
+    """
+    Encode content as line copies from base and inserted bytes.
+    """
+    base_lines = base.splitlines(keepends=True)
+    lines = content.splitlines(keepends=True)
+    encoded = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, base_lines, lines).get_opcodes():
+        if tag == "equal":
+            encoded.append(COPY + struct.pack(">II", i1, i2 - i1))
+        elif j2 > j1:
+            inserted = b"".join(lines[j1:j2])
+            encoded.append(INSERT + struct.pack(">I", len(inserted)) + inserted)
+    return b"".join(encoded)
+
+def apply_delta(base, encoded):
+    base_lines = base.splitlines(keepends=True)
+    content = []
+    position = 0
+    while position < len(encoded):
+        instruction = encoded[position:position + 1]
+        if instruction == COPY:
+            start, count = struct.unpack(">II", encoded[position + 1:position + 9])
+            content += base_lines[start:start + count]
+            position += 9
+        else:
+            length, = struct.unpack(">I", encoded[position + 1:position + 5])
+            content.append(encoded[position + 5:position + 5 + length])
+            position += 5 + length
+    return b"".join(content)
+
+class Pack:
+    """
+    Random access reader of a pack, entries are looked up by (dataset, side, project, id, filename).
+    """
+
+    def __init__(self, archive):
+        self.file = open(archive, 'rb')
+        if self.file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{archive} is not a dataset pack")
+        self.file.seek(-struct.calcsize(TRAILER), os.SEEK_END)
+        index_offset, index_length = struct.unpack(TRAILER, self.file.read(struct.calcsize(TRAILER)))
+        self.file.seek(index_offset)
+        self.index = json.loads(zlib.decompress(self.file.read(index_length)))
+        self.positions = {key(entry): position for position, entry in enumerate(self.index)}
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def keys(self):
+        return list(self.positions)
+
+    def read(self, dataset, side, project, id, filename):
+        return self.read_entry(self.positions[(dataset, side, project, str(id), filename)])
+
+    def read_pair(self, dataset, project, id, filename):
+        return (self.read(dataset, BEFORE_FOLDER_NAME, project, id, filename), self.read(dataset, AFTER_FOLDER_NAME, project, id, filename))
+
+    def read_entry(self, position):
+        entry = self.index[position]
+        self.file.seek(entry["offset"])
+        data = zlib.decompress(self.file.read(entry["length"]))
+        if entry["base"] == None:
+            return data
+        return apply_delta(self.read_entry(entry["base"]), data)
+
+    def extract(self, dest):
+        for position, entry in enumerate(self.index):
+            path = f"{dest}/{entry_path(entry)}"
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(self.read_entry(position))
+
+def key(entry):
+    return (entry["dataset"], entry["side"], entry["project"], entry["id"], entry["filename"])
+
+if __name__ == '__main__':
+    command = sys.argv[1]
+    archive = sys.argv[2]
+    if command == "build":
+        index = build(archive, sys.argv[3:])
+        print(f"Packed {str(len(index))} files, {str(sum(1 for entry in index if entry['base'] != None))} as deltas, in {str(os.path.getsize(archive))} bytes")
+    elif command == "list":
+        with Pack(archive) as pack:
+            for entry in pack.index:
+                print(entry_path(entry))
+    elif command == "extract":
+        with Pack(archive) as pack:
+            pack.extract(sys.argv[3])
+    elif command == "cat":
+        with Pack(archive) as pack:
+            sys.stdout.buffer.write(pack.read(*sys.argv[3:8]))
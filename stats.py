@@ -1,27 +1,316 @@
 #!/usr/bin/env python3
-import sys
-import pandas as pd
-from io import StringIO
+import os
+import csv
 import glob
-import subprocess
-
-def compute_stats(dataset, extension):
-    all_lines = pd.DataFrame()
-    for before_file in glob.glob(f"{dataset}/before/**/*." + extension, recursive = True):
-        after_file = f"{dataset}/after" + before_file[len(f"{dataset}/before"):]
-        ps = subprocess.Popen(('diff', '-u', before_file, after_file), stdout=subprocess.PIPE)
-        output = subprocess.check_output(('diffstat', '-t'), stdin=ps.stdout)
-        ps.wait()
-        csv_string = StringIO(output.decode('UTF-8'))
-        line  = pd.read_csv(csv_string, sep=",")
-        line["FILENAME"] = before_file
-        if all_lines.empty:
-            all_lines = line
+import itertools
+import collections
+import sqlite3
+import argparse
+import blobstore
+from concurrent.futures import ProcessPoolExecutor
+
+COLUMNS = ["INSERTED", "DELETED", "MODIFIED", "FILENAME"]
+# Lines of the identical prefix and suffix GNU diff keeps in the analysis, the context of diff -u
+HORIZON_LINES = 3
+STATS_CACHE = ".stats-cache.sqlite"
+CACHE_COMMIT_INTERVAL = 1000
+# Pairs diffed by a worker task, and tasks in flight per worker
+CHUNK_PAIRS = 64
+CHUNKS_PER_WORKER = 4
+
+PARQUET_BATCH_ROWS = 10000
+
+# Datasets of the notebook with the extension of their files and the name of their benchmark
+DATASETS = [("bugsinpy", "py", "BugsInPy"), ("gh-python", "py", "GhPython"), ("defects4j", "java", "Defects4J"), ("gh-java", "java", "GhJava")]
+UNPARSABLE_PATH = "unparsable"
+
+# Read-only connection of a worker to the stats cache
+cache = None
+
+def compute_stats(dataset, extension, jobs=None, data_frame=False, cache_file=STATS_CACHE):
+    """
+    Write the diff statistics of a dataset to <dataset>-sizes.csv row by row, as the workers
+    finish the files in order. The rows are only loaded in a DataFrame when data_frame is set.
+    The statistics of a pair are kept in the cache_file sqlite database under the hashes of
+    its before and after contents, so a pair is only diffed once across runs and datasets.
+    """
+    sizes_file = f"{dataset}-sizes.csv"
+    before_files = glob.iglob(f"{dataset}/before/**/*." + extension, recursive = True)
+    with open(sizes_file, 'w', newline='') as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(COLUMNS)
+        for _, row in stats_rows(((before_file, dataset) for before_file in before_files), jobs, cache_file):
+            writer.writerow(row)
+    if data_frame:
+        import pandas as pd
+        return pd.read_csv(sizes_file)
+
+def compute_all_stats(output, unparsable=False, jobs=None, cache_file=STATS_CACHE):
+    """
+    Write the diff statistics of every dataset to a single Parquet file in one parallel pass,
+    with the BENCHMARK, PROJECT, ID and TOTAL columns that the notebook otherwise computes.
+    The unparsable commits of each dataset are included when unparsable is set.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    benchmarks = {}
+    for dataset, extension, benchmark in DATASETS:
+        benchmarks[dataset] = (extension, benchmark, False)
+        if unparsable:
+            benchmarks[f"{UNPARSABLE_PATH}/{dataset}"] = (extension, benchmark, True)
+    pairs = ((before_file, dataset) for dataset, (extension, _, _) in benchmarks.items()
+             for before_file in glob.iglob(f"{dataset}/before/**/*." + extension, recursive = True))
+    schema = pa.schema([("BENCHMARK", pa.string()), ("PROJECT", pa.string()), ("ID", pa.string()), ("FILENAME", pa.string()),
+                        ("INSERTED", pa.int64()), ("DELETED", pa.int64()), ("MODIFIED", pa.int64()), ("TOTAL", pa.int64()),
+                        ("UNPARSABLE", pa.bool_())])
+    columns = {name: [] for name in schema.names}
+    with pq.ParquetWriter(output, schema) as writer:
+        for dataset, (inserted, deleted, modified, filename) in stats_rows(pairs, jobs, cache_file):
+            _, benchmark, is_unparsable = benchmarks[dataset]
+            project, id = filename[len(f"{dataset}/before/"):].split("/")[:2]
+            for name, value in zip(schema.names, [benchmark, project, id, filename, inserted, deleted, modified, inserted + deleted + modified, is_unparsable]):
+                columns[name].append(value)
+            if len(columns["FILENAME"]) == PARQUET_BATCH_ROWS:
+                writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+                columns = {name: [] for name in schema.names}
+        writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+
+def stats_rows(pairs, jobs=None, cache_file=STATS_CACHE):
+    """
+    Yield the (dataset, row) of the (before file, dataset) pairs that differ, in order, computed
+    by a process pool and cached in the cache_file sqlite database. The pairs are submitted in
+    chunks as results are consumed, so only a few chunks per worker are pending at a time.
+    """
+    connection = open_cache(cache_file)
+    new_entries = 0
+    try:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(cache_file,)) as executor:
+            for dataset, row, entry in bounded_map(executor, pairs, (jobs or os.cpu_count() or 1) * CHUNKS_PER_WORKER):
+                if entry != None:
+                    connection.execute("INSERT OR REPLACE INTO stats VALUES (?, ?, ?, ?)", entry)
+                    new_entries += 1
+                    if new_entries % CACHE_COMMIT_INTERVAL == 0:
+                        connection.commit()
+                if row != None:
+                    yield dataset, row
+    finally:
+        connection.commit()
+        connection.close()
+
+def bounded_map(executor, pairs, window):
+    """
+    Yield the pair_stats results of the pairs in order, with at most window chunks submitted
+    and not yet consumed, unlike executor.map which submits all the pairs up front.
+    """
+    pairs = iter(pairs)
+    pending = collections.deque()
+    chunks = iter(lambda: list(itertools.islice(pairs, CHUNK_PAIRS)), [])
+    for chunk in chunks:
+        pending.append(executor.submit(chunk_stats, chunk))
+        if len(pending) >= window:
+            yield from pending.popleft().result()
+    while len(pending) > 0:
+        yield from pending.popleft().result()
+
+def open_cache(cache_file):
+    connection = sqlite3.connect(cache_file)
+    # Workers keep reading the cache while new entries are written
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("CREATE TABLE IF NOT EXISTS stats (before_digest TEXT, after_digest TEXT, inserted INTEGER, deleted INTEGER, PRIMARY KEY (before_digest, after_digest))")
+    connection.commit()
+    return connection
+
+def init_worker(cache_file):
+    global cache
+    cache = sqlite3.connect(cache_file)
+
+def chunk_stats(chunk):
+    return [(dataset,) + file_stats(before_file, dataset) for before_file, dataset in chunk]
+
+def file_stats(before_file, dataset):
+    """
+    Return the INSERTED, DELETED, MODIFIED, FILENAME row of diff -u | diffstat -t for a before
+    file and its after file, or None when they are identical like diffstat does. Without -m,
+    diffstat counts a modified line as one deletion and one insertion, so MODIFIED is always 0.
+    The row comes with the new cache entry of the pair, or None if the pair was cached.
+    """
+    after_file = f"{dataset}/after" + before_file[len(f"{dataset}/before"):]
+    if not os.path.exists(after_file):
+        return None, None
+    with open(before_file, 'rb') as f:
+        before_content = f.read()
+    with open(after_file, 'rb') as f:
+        after_content = f.read()
+    if before_content == after_content:
+        return None, None
+    key = (blobstore.digest(before_content), blobstore.digest(after_content))
+    if cache != None:
+        cached = cache.execute("SELECT inserted, deleted FROM stats WHERE before_digest = ? AND after_digest = ?", key).fetchone()
+        if cached != None:
+            return [cached[0], cached[1], 0, before_file], None
+    before_lines = split_lines(before_content)
+    after_lines = split_lines(after_content)
+    common = common_lines(before_lines, after_lines)
+    inserted = len(after_lines) - common
+    deleted = len(before_lines) - common
+    return [inserted, deleted, 0, before_file], key + (inserted, deleted)
+
+def split_lines(content):
+    # Lines as diff sees them, a last line without newline differs from the same line with one
+    lines = content.split(b"\n")
+    return [line + b"\n" for line in lines[:-1]] + ([lines[-1]] if lines[-1] != b"" else [])
+
+def common_lines(a, b):
+    """
+    Return the number of lines diff keeps in common between two lists of lines. Like GNU diff,
+    the common prefix and suffix are trimmed, the lines confusing the matching are discarded,
+    and the shortest edit script of the remaining lines is found with the algorithm of Myers.
+    """
+    prefix = 0
+    while prefix < len(a) and prefix < len(b) and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < len(a) - prefix and suffix < len(b) - prefix and a[-1 - suffix] == b[-1 - suffix]:
+        suffix += 1
+    prefix = max(prefix - HORIZON_LINES, 0)
+    suffix = max(suffix - HORIZON_LINES, 0)
+    a = a[prefix:len(a) - suffix]
+    b = b[prefix:len(b) - suffix]
+    a_discards = confusing_lines(a, b)
+    b_discards = confusing_lines(b, a)
+    a = [line for line, discard in zip(a, a_discards) if discard == 0]
+    b = [line for line, discard in zip(b, b_discards) if discard == 0]
+    return prefix + suffix + longest_common_subsequence(a, b)
+
+def confusing_lines(lines, other_lines):
+    """
+    Port of discard_confusing_lines of GNU diff: mark the lines of one side that are missing
+    from the other side (1), or too frequent in it (2), and keep only the marks of the runs
+    that the matching can skip as a whole.
+    """
+    counts = {}
+    for line in other_lines:
+        counts[line] = counts.get(line, 0) + 1
+    end = len(lines)
+    many = 5
+    tem = end // 64
+    while True:
+        tem >>= 2
+        if tem <= 0:
+            break
+        many *= 2
+    discards = [0] * end
+    for i, line in enumerate(lines):
+        matches = counts.get(line, 0)
+        if matches == 0:
+            discards[i] = 1
+        elif matches > many:
+            discards[i] = 2
+
+    i = 0
+    while i < end:
+        if discards[i] == 2:
+            discards[i] = 0
+        elif discards[i] != 0:
+            provisional = 0
+            j = i
+            while j < end and discards[j] != 0:
+                if discards[j] == 2:
+                    provisional += 1
+                j += 1
+            while j > i and discards[j - 1] == 2:
+                j -= 1
+                discards[j] = 0
+                provisional -= 1
+            length = j - i
+            if provisional * 4 > length:
+                while j > i:
+                    j -= 1
+                    if discards[j] == 2:
+                        discards[j] = 0
+            else:
+                minimum = 1
+                tem = length >> 2
+                while True:
+                    tem >>= 2
+                    if tem <= 0:
+                        break
+                    minimum <<= 1
+                minimum += 1
+                j = 0
+                consec = 0
+                while j < length:
+                    if discards[i + j] != 2:
+                        consec = 0
+                    else:
+                        consec += 1
+                        if minimum == consec:
+                            j -= consec
+                        elif minimum < consec:
+                            discards[i + j] = 0
+                    j += 1
+                cancel_provisional(discards, [i + j for j in range(length)])
+                i += length - 1
+                cancel_provisional(discards, [i - j for j in range(length)])
+        i += 1
+    return discards
+
+def cancel_provisional(discards, run):
+    # Cancel the provisional discards of a run until 3 discards in a row, or a discard 8 lines in
+    consec = 0
+    for j, position in enumerate(run):
+        if j >= 8 and discards[position] == 1:
+            break
+        if discards[position] == 2:
+            consec = 0
+            discards[position] = 0
+        elif discards[position] == 0:
+            consec = 0
         else:
-            all_lines = pd.concat([all_lines, line], ignore_index=True)
-    all_lines.to_csv(f"{dataset}-sizes.csv", index=False)
+            consec += 1
+        if consec == 3:
+            break
+
+def longest_common_subsequence(a, b):
+    """
+    Return the length of a longest common subsequence of two lists of lines, from the length
+    of their shortest edit script found with the greedy algorithm of Myers.
+    """
+    n = len(a)
+    m = len(b)
+    if n == 0 or m == 0:
+        return 0
+    # furthest[k] is the furthest x reached on diagonal k = x - y, shifted by the offset
+    offset = n + m + 1
+    furthest = [0] * (2 * offset + 1)
+    for distance in range(n + m + 1):
+        for k in range(-distance, distance + 1, 2):
+            if k == -distance or (k != distance and furthest[offset + k - 1] < furthest[offset + k + 1]):
+                x = furthest[offset + k + 1]
+            else:
+                x = furthest[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            furthest[offset + k] = x
+            if x >= n and y >= m:
+                return (n + m - distance) // 2
+    return 0
 
 if __name__ == '__main__':
-    dataset = sys.argv[1]
-    extension = sys.argv[2]
-    compute_stats(dataset, extension)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Compute the diff sizes of the datasets.")
+    parser.add_argument("dataset", nargs="?", help="dataset folder, its sizes are written to <dataset>-sizes.csv")
+    parser.add_argument("extension", nargs="?", help="extension of the files of the dataset, without dot")
+    parser.add_argument("--parquet", help="compute the sizes of all the datasets in one pass and write them to this Parquet file")
+    parser.add_argument("--unparsable", action="store_true", help="include the unparsable commits in the Parquet file")
+    parser.add_argument("--jobs", type=int, help="number of worker processes, defaults to the number of CPUs")
+    parser.add_argument("--cache", default=STATS_CACHE, help="sqlite cache of the sizes of the file pairs")
+    args = parser.parse_args()
+    if args.parquet != None:
+        compute_all_stats(args.parquet, args.unparsable, args.jobs, args.cache)
+    elif args.extension != None:
+        compute_stats(args.dataset, args.extension, args.jobs, cache_file=args.cache)
+    else:
+        parser.error("either a dataset and its extension, or --parquet, is required")
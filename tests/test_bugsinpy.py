@@ -0,0 +1,59 @@
+import os
+import subprocess
+import bugsinpy
+import extraction
+
+def git(repository, *arguments):
+    environment = dict(os.environ, GIT_AUTHOR_NAME="test", GIT_AUTHOR_EMAIL="test@example.com",
+                       GIT_COMMITTER_NAME="test", GIT_COMMITTER_EMAIL="test@example.com")
+    return subprocess.run(["git", "-C", str(repository)] + list(arguments), check=True, capture_output=True, text=True, env=environment).stdout.strip()
+
+def commit(repository, files, message):
+    for path, content in files.items():
+        os.makedirs(os.path.dirname(f"{repository}/{path}"), exist_ok=True)
+        with open(f"{repository}/{path}", 'w') as f:
+            f.write(content)
+    git(repository, "add", "-A")
+    git(repository, "commit", "--quiet", "-m", message)
+    return git(repository, "rev-parse", "HEAD")
+
+def stand_in(tmp_path):
+    """
+    A BugsInPy framework folder with one project served by a local repository, and two bugs
+    whose fixes change a source file and its test file.
+    """
+    repository = tmp_path / "demo"
+    git(tmp_path, "init", "--quiet", str(repository))
+    commits = [commit(repository, {"demo/core.py": f"x = {str(version)}\n", "tests/test_core.py": f"assert {str(version)}\n"}, f"v{str(version)}")
+               for version in range(3)]
+    home = tmp_path / "BugsInPy"
+    os.makedirs(home / "projects" / "demo" / "bugs")
+    with open(home / "projects" / "demo" / "project.info", 'w') as f:
+        f.write(f'github_url="{str(repository)}"\n')
+    for bug in [1, 2]:
+        os.makedirs(home / "projects" / "demo" / "bugs" / str(bug))
+        with open(home / "projects" / "demo" / "bugs" / str(bug) / "bug.info", 'w') as f:
+            f.write(f'buggy_commit_id="{commits[bug - 1]}"\nfixed_commit_id="{commits[bug]}"\ntest_file="tests/test_core.py"\n')
+    return home
+
+def test_mirror_checkouts_match_bugsinpy_checkout(tmp_path, monkeypatch, capsys):
+    home = stand_in(tmp_path)
+    monkeypatch.setattr(bugsinpy, "projects", lambda: ["demo"])
+    backend = bugsinpy.BugsInPy("bugsinpy", 2, str(tmp_path / "metadata.json"), str(tmp_path / "mirrors"), str(home))
+    failures = extraction.Extraction(str(tmp_path / "out"), str(tmp_path / "tmp")).run(backend)
+
+    assert failures == []
+    # The mirror is cloned once for both bugs
+    assert capsys.readouterr().out.count("Mirroring demo") == 1
+    for bug in ["1", "2"]:
+        # Like bugsinpy-checkout, the buggy version has the fixed test files, so only the source differs
+        assert sorted(os.listdir(tmp_path / "out" / "before" / "demo" / bug)) == ["demo_core.py"]
+        assert sorted(os.listdir(tmp_path / "out" / "after" / "demo" / bug)) == ["demo_core.py"]
+        with open(tmp_path / "out" / "before" / "demo" / bug / "demo_core.py") as f:
+            assert f.read() == f"x = {str(int(bug) - 1)}\n"
+        with open(tmp_path / "out" / "after" / "demo" / bug / "demo_core.py") as f:
+            assert f.read() == f"x = {bug}\n"
+
+def test_test_paths():
+    assert bugsinpy.test_paths({"test_file": "tests/a.py; tests/b.py;"}) == ["tests/a.py", "tests/b.py"]
+    assert bugsinpy.test_paths({}) == []
@@ -0,0 +1,94 @@
+import os
+import sys
+import gzip
+import json
+import extract_cases
+import gumtree_worker
+
+FAKE_WORKER = [sys.executable, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fake_gumtree_worker.py")]
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+def cases(tmp_path, monkeypatch, rows):
+    monkeypatch.chdir(tmp_path)
+    write("a/before/A.java", "class A {}\n")
+    write("a/after/A.java", "class A { int x; }\n")
+    write("cases.csv", "before,after\n" + "".join(f"{before},{after}\n" for before, after in rows))
+    os.makedirs("out")
+    return "cases.csv"
+
+def test_renders_every_matcher_and_reports_missing_files(tmp_path, monkeypatch):
+    cases_file = cases(tmp_path, monkeypatch, [("a/before/A.java", "a/after/A.java"), ("a/before/Missing.java", "a/after/Missing.java")])
+    failures = extract_cases.extract_cases(cases_file, "out", jobs=2, worker_command=FAKE_WORKER, version="fake")
+
+    assert sorted(failures) == ["out/a_before_Missing.java_opt.html", "out/a_before_Missing.java_simple.html"]
+    with open("out/a_before_A.java_opt.html") as f:
+        assert "default" in f.read()
+    with open("out/a_before_A.java_simple.html") as f:
+        assert "gumtree-simple" in f.read()
+
+def test_skips_cached_renderings(tmp_path, monkeypatch, capsys):
+    cases_file = cases(tmp_path, monkeypatch, [("a/before/A.java", "a/after/A.java")])
+    extract_cases.extract_cases(cases_file, "out", worker_command=FAKE_WORKER, version="fake")
+    assert "2 of 2 renderings to update" in capsys.readouterr().out
+
+    assert extract_cases.extract_cases(cases_file, "out", worker_command=FAKE_WORKER, version="fake") == []
+    assert "0 of 2 renderings to update" in capsys.readouterr().out
+
+    # A changed input or gumtree version renders again
+    write("a/after/A.java", "class A { int y; }\n")
+    extract_cases.extract_cases(cases_file, "out", worker_command=FAKE_WORKER, version="fake")
+    assert "2 of 2 renderings to update" in capsys.readouterr().out
+    extract_cases.extract_cases(cases_file, "out", worker_command=FAKE_WORKER, version="other")
+    assert "2 of 2 renderings to update" in capsys.readouterr().out
+
+def test_worker_crash_only_fails_its_job(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write("a/before/A.java", "class A {}\n")
+    write("a/after/A.java", "class A { int x; }\n")
+    jobs = [("crash", "a/after/A.java", None, [(None, "crash.html")]),
+            ("a/before/A.java", "a/after/A.java", None, [(None, "a.html"), ("gumtree-simple", "-")])]
+    results = gumtree_worker.run_jobs(FAKE_WORKER, jobs, 1)
+
+    assert results[0] == [("worker exited", None)]
+    assert results[1][0] == (None, None)
+    assert results[1][1][0] == None and json.loads(results[1][1][1])["actions"][0]["action"] == "update-node"
+
+def test_worker_that_cannot_start(tmp_path):
+    results = gumtree_worker.run_jobs([str(tmp_path / "does-not-exist")], [("a", "b", None, [(None, "a.html"), ("gumtree-simple", "b.html")])], 2)
+
+    assert len(results) == 1 and len(results[0]) == 2
+    assert all(error.startswith("worker cannot start") and edits == None for error, edits in results[0])
+
+def test_edit_script_store(tmp_path, monkeypatch):
+    cases_file = cases(tmp_path, monkeypatch, [("a/before/A.java", "a/after/A.java"), ("a/before/Missing.java", "a/after/Missing.java")])
+    store = extract_cases.extract_edits(cases_file, "out", 2, FAKE_WORKER)
+
+    records = list(extract_cases.read_edits(store))
+    assert [(record["before"], record["matcher"]) for record in records] == [("a/before/A.java", None), ("a/before/A.java", "gumtree-simple")]
+    assert all(len(record["mappings"]) == 1 for record in records)
+
+def test_reply_with_wrong_status_count_fails_the_job():
+    short_worker = [sys.executable, "-c", "import sys\nfor line in sys.stdin: print('ok', flush=True)"]
+    results = gumtree_worker.run_jobs(short_worker, [("a", "b", None, [(None, "a.html"), ("gumtree-simple", "b.html")]), ("c", "d", None, [(None, "c.html")])], 1)
+
+    assert [error for error, _ in results[0]] == ["worker replied 1 statuses for 2 renderings"] * 2
+    assert results[1] == [(None, None)]
+
+def test_check_worker_against_htmldiff(tmp_path, monkeypatch):
+    cases_file = cases(tmp_path, monkeypatch, [("a/before/A.java", "a/after/A.java")])
+    # A gumtree launcher whose htmldiff writes the html of the fake worker, except for gumtree-simple
+    write("gumtree", f"""#!{sys.executable}
+import sys
+_, before, after, *options = sys.argv[1:]
+matcher = options[options.index("-m") + 1] if "-m" in options else "default"
+print(f"<html><body>{{before}} {{after}} {{matcher if matcher != 'gumtree-simple' else 'other'}} default</body></html>")
+""")
+    os.chmod("gumtree", 0o755)
+    differences = extract_cases.check_worker(cases_file, "check", 1, FAKE_WORKER, os.path.abspath("gumtree"))
+
+    assert differences == ["check/worker/a_before_A.java_simple.html"]
+    assert os.path.exists("check/htmldiff/a_before_A.java_opt.html")
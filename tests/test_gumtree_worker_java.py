@@ -0,0 +1,53 @@
+import os
+import shutil
+import pytest
+import extract_cases
+import gumtree_worker
+
+# Checks GumTreeWorker.java against the gumtree launcher of a GumTree distribution
+GUMTREE_HOME = os.environ.get("GUMTREE_HOME")
+pytestmark = pytest.mark.skipif(shutil.which("java") == None or GUMTREE_HOME == None, reason="needs java and a GumTree distribution in GUMTREE_HOME")
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+def java_cases(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write("a/before/A.java", "class A {\n  int f(int x) {\n    return x + 1;\n  }\n}\n")
+    write("a/after/A.java", "class A {\n  int f(int x) {\n    int y = x * 2;\n    return y + 1;\n  }\n\n  void g() {}\n}\n")
+    write("a/before/B.java", "class B {\n  void f() { g(); h(); }\n}\n")
+    write("a/after/B.java", "class B {\n  void f() { h(); g(); }\n}\n")
+    write("cases.csv", "before,after\na/before/A.java,a/after/A.java\na/before/B.java,a/after/B.java\n")
+    return "cases.csv"
+
+def test_distribution_is_the_pinned_release():
+    assert gumtree_worker.gumtree_release(GUMTREE_HOME) == gumtree_worker.GUMTREE_RELEASE
+
+def test_worker_renders_like_htmldiff(tmp_path, monkeypatch):
+    cases_file = java_cases(tmp_path, monkeypatch)
+    command = gumtree_worker.worker_command(GUMTREE_HOME)
+
+    assert extract_cases.check_worker(cases_file, "check", 2, command, f"{GUMTREE_HOME}/bin/gumtree") == []
+
+@pytest.mark.skipif(shutil.which("tree-sitter-parser") == None, reason="needs the tree-sitter-parser of gumtree")
+def test_worker_parses_python_once_for_all_matchers(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # Cases under bugsinpy use the python-treesitter generator
+    write("bugsinpy/before/p/1/a.py", "def f(x):\n    return x + 1\n")
+    write("bugsinpy/after/p/1/a.py", "def f(x):\n    y = x * 2\n    return y + 1\n")
+    write("cases.csv", "before,after\nbugsinpy/before/p/1/a.py,bugsinpy/after/p/1/a.py\n")
+    command = gumtree_worker.worker_command(GUMTREE_HOME)
+
+    assert extract_cases.check_worker("cases.csv", "check", 1, command, f"{GUMTREE_HOME}/bin/gumtree") == []
+
+def test_worker_edit_scripts(tmp_path, monkeypatch):
+    cases_file = java_cases(tmp_path, monkeypatch)
+    store = extract_cases.extract_edits(cases_file, "out", 1, gumtree_worker.worker_command(GUMTREE_HOME))
+
+    records = list(extract_cases.read_edits(store))
+    assert len(records) == 4
+    for record in records:
+        assert len(record["mappings"]) > 0 and len(record["actions"]) > 0
+        assert all(len(node) == 4 for mapping in record["mappings"] for node in mapping)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+import os
+import subprocess
+
+def git(repository, *arguments):
+    """
+    Run a git command in the given repository and return its standard output.
+    """
+    result = subprocess.run(["git", "-C", repository] + list(arguments), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    return result.stdout.decode("UTF-8")
+
+def head(repository):
+    """
+    Return the commit checked out in the given repository, or None if it is not a git checkout.
+    """
+    try:
+        return git(repository, "rev-parse", "--verify", "HEAD").strip()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+def has_commit(repository, commit):
+    try:
+        git(repository, "cat-file", "-e", f"{commit}^{{commit}}")
+        return True
+    except (subprocess.CalledProcessError, OSError):
+        return False
+
+def changed_paths(before, after, extension, before_revision=None):
+    """
+    Ask git for the paths ending with extension that differ between the before and after checkouts.
+    before_revision names the before version inside the after repository and defaults to the commit
+    checked out in before. Uncommitted modifications of both working trees are included. Returns None
+    when the checkouts are not git repositories sharing that revision, so that callers can fall back
+    to a full walk.
+    """
+    if before_revision == None:
+        before_revision = head(before)
+    if before_revision == None or head(after) == None or not has_commit(after, before_revision):
+        return None
+    pathspec = f"*{extension}"
+    try:
+        paths = git(after, "diff", "--name-only", "--no-renames", "-z", before_revision, "--", pathspec).split("\0")
+        paths += git(before, "diff", "--name-only", "--no-renames", "-z", "HEAD", "--", pathspec).split("\0")
+    except (subprocess.CalledProcessError, OSError):
+        return None
+    return sorted(set(path for path in paths if path != ""))
+
+def newest_commit(repository, commits):
+    """
+    Return the most recent of the given commits known to the repository, or None if it knows none.
+    """
+    try:
+        newest = git(repository, "rev-list", "--no-walk=sorted", "--ignore-missing", "--max-count=1", *commits).strip()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+    return newest or None
+
+def clone_mirror(url, mirror):
+    """
+    Clone url as a bare mirror. The clone is made next to mirror and renamed, so an interrupted
+    clone never leaves a partial mirror behind.
+    """
+    partial = f"{mirror}.partial"
+    subprocess.run(["rm", "-rf", partial], check=True)
+    subprocess.run(["git", "clone", "--quiet", "--mirror", url, partial], check=True)
+    os.rename(partial, mirror)
+
+def update_mirror(mirror):
+    """
+    Fetch the new commits of the origin of a mirror, moving its branches like the origin did.
+    """
+    git(mirror, "fetch", "--quiet", "--prune", "origin")
+
+def remote_head(url):
+    """
+    Return the commit of the HEAD of a remote repository, without cloning it.
+    """
+    return git(".", "ls-remote", url, "HEAD").split()[0]
+
+def add_worktree(mirror, revision, worktree):
+    """
+    Check out revision of the mirror in a new detached worktree, sharing the objects of the mirror.
+    """
+    git(mirror, "worktree", "prune")
+    git(mirror, "worktree", "add", "--force", "--detach", os.path.abspath(worktree), revision)
+
+def remove_worktree(mirror, worktree):
+    git(mirror, "worktree", "remove", "--force", os.path.abspath(worktree))
+
+def patch_paths(repository, patch):
+    """
+    Return the paths touched by a patch file, as seen by git apply in the given repository.
+    """
+    entries = git(repository, "apply", "--numstat", "-z", os.path.abspath(patch)).split("\0")
+    return [entry.split("\t")[2] for entry in entries if entry.count("\t") == 2]
+
+def log_changes(repository, revisions, extension, numstat=False):
+    """
+    Stream the (commit, commit time, [(status, path, old blob, new blob, changed lines)]) of the
+    non-merge commits of revisions, oldest first, keeping the paths ending with extension.
+    Changed lines are only counted with numstat. Only git log runs, no blob is read.
+    """
+    command = ["git", "-C", repository, "-c", "core.quotepath=off", "log", "--reverse", "--no-merges", "--raw", "--no-abbrev",
+               "--no-renames", "--format=commit %H %ct"] + (["--numstat"] if numstat else []) + [revisions, "--", f"*{extension}"]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        commit = None
+        for line in process.stdout:
+            line = line.decode("UTF-8", errors="replace").rstrip("\n")
+            if line.startswith("commit "):
+                if commit != None:
+                    yield commit, commit_time, [change + (changed_lines.get(change[1]),) for change in changes]
+                _, commit, commit_time = line.split(" ")
+                commit_time = int(commit_time)
+                changes = []
+                changed_lines = {}
+            elif line.startswith(":"):
+                # :<old mode> <new mode> <old blob> <new blob> <status>\t<path>
+                fields, path = line[1:].split("\t", 1)
+                _, _, old_blob, new_blob, status = fields.split(" ")
+                if path.endswith(extension):
+                    changes.append((status, path, old_blob, new_blob))
+            elif line.count("\t") >= 2:
+                # <added>\t<deleted>\t<path>, binary files show - instead of counts
+                added, deleted, path = line.split("\t", 2)
+                if added.isdigit() and deleted.isdigit():
+                    changed_lines[path] = int(added) + int(deleted)
+        if commit != None:
+            yield commit, commit_time, [change + (changed_lines.get(change[1]),) for change in changes]
+    finally:
+        process.kill()
+        process.wait()
+
+class CatFileBatch:
+    """
+    A long-lived git cat-file --batch process reading many blobs of a repository through one pipe.
+    """
+
+    def __init__(self, repository):
+        self.process = subprocess.Popen(["git", "-C", repository, "cat-file", "--batch"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def read_many(self, objects):
+        """
+        Return the contents of the given objects, each requested once the previous one is read back.
+        """
+        contents = []
+        for name in objects:
+            # Writing all the requests first fills the pipes and blocks both processes on large batches
+            self.process.stdin.write(f"{name}\n".encode("UTF-8"))
+            self.process.stdin.flush()
+            header = self.process.stdout.readline().decode("UTF-8").split()
+            if len(header) != 3:
+                raise KeyError(f"Object {name} is missing")
+            contents.append(self.process.stdout.read(int(header[2])))
+            self.process.stdout.read(1)
+        return contents
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()